@@ -0,0 +1,174 @@
+# admission.py
+"""
+Admission control for the mention path.
+
+Each mention is admitted at a degradation level computed from how many
+replies are in flight, how long recent replies waited for a model slot, and
+the guild's token budget:
+
+    FULL         normal reply
+    NO_CONTEXT   skip ambient, mentioned-user and search context
+    CHEAP_MODEL  ... and answer with OPENAI_CHEAP_MODEL
+    DEFER_FACTS  ... and queue full fact batches for the background drain
+    BUSY         send a short "busy" reply instead of calling the model
+
+Model calls run off the event loop behind a semaphore, so waiting for a slot
+is the queue latency the controller reacts to.
+"""
+import asyncio
+import math
+import os
+import time
+from enum import IntEnum
+from typing import Dict, Optional
+
+import metrics
+
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "8"))
+ADMISSION_MODEL_CONCURRENCY = int(os.getenv("ADMISSION_MODEL_CONCURRENCY", "4"))
+ADMISSION_TARGET_WAIT_MS = float(os.getenv("ADMISSION_TARGET_WAIT_MS", "2000"))
+# 0 disables per-guild budgets.
+ADMISSION_GUILD_TOKENS_PER_MIN = int(os.getenv("ADMISSION_GUILD_TOKENS_PER_MIN", "0"))
+
+BUSY_REPLY = "I'm handling a lot of requests right now. Please try again in a minute."
+
+
+class Level(IntEnum):
+    FULL = 0
+    NO_CONTEXT = 1
+    CHEAP_MODEL = 2
+    DEFER_FACTS = 3
+    BUSY = 4
+
+
+# Load (1.0 = at capacity) at which each level starts.
+_THRESHOLDS = (
+    (1.5, Level.BUSY),
+    (1.0, Level.DEFER_FACTS),
+    (0.75, Level.CHEAP_MODEL),
+    (0.5, Level.NO_CONTEXT),
+)
+
+
+class _GuildBudget:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class Ticket:
+    """One admitted mention; use as a context manager to track it in flight."""
+
+    def __init__(self, controller: "AdmissionController", guild_id: Optional[int], level: Level):
+        self.controller = controller
+        self.guild_id = guild_id
+        self.level = level
+
+    def __enter__(self):
+        self.controller._inflight += 1
+        metrics.add_inflight("mention", 1)
+        return self
+
+    def __exit__(self, *exc):
+        self.controller._inflight -= 1
+        metrics.add_inflight("mention", -1)
+        return False
+
+    async def run_model(self, fn, *args, **kwargs):
+        """Run a blocking model call in a worker thread once a slot is free."""
+        return await self.controller.run_model(fn, *args, **kwargs)
+
+    def charge(self, tokens: int):
+        self.controller.charge(self.guild_id, tokens)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        model_concurrency: int = ADMISSION_MODEL_CONCURRENCY,
+        target_wait_ms: float = ADMISSION_TARGET_WAIT_MS,
+        guild_tokens_per_min: int = ADMISSION_GUILD_TOKENS_PER_MIN,
+        decay_seconds: float = 30.0,
+    ):
+        self.max_inflight = max_inflight
+        self.target_wait = target_wait_ms / 1000
+        self.guild_tokens_per_min = guild_tokens_per_min
+        self.decay_seconds = decay_seconds
+        self._model_slots = asyncio.Semaphore(model_concurrency)
+        self._inflight = 0
+        self._wait_ewma = 0.0
+        self._wait_updated = time.monotonic()
+        self._budgets: Dict[int, _GuildBudget] = {}
+
+    # ---------- signals ----------
+    def _decayed_wait(self) -> float:
+        elapsed = time.monotonic() - self._wait_updated
+        return self._wait_ewma * math.exp(-elapsed / self.decay_seconds)
+
+    def _observe_wait(self, seconds: float):
+        self._wait_ewma = 0.8 * self._decayed_wait() + 0.2 * seconds
+        self._wait_updated = time.monotonic()
+        metrics.registry.observe(
+            "agent_model_queue_seconds", seconds, help="Time a reply waited for a model slot."
+        )
+
+    def load(self) -> float:
+        return max(self._inflight / self.max_inflight, self._decayed_wait() / self.target_wait)
+
+    def current_level(self) -> Level:
+        """Process-wide level, ignoring guild budgets."""
+        load = self.load()
+        for threshold, level in _THRESHOLDS:
+            if load >= threshold:
+                return level
+        return Level.FULL
+
+    def _over_budget(self, guild_id: Optional[int]) -> bool:
+        if not self.guild_tokens_per_min or guild_id is None:
+            return False
+        budget = self._budgets.get(guild_id)
+        return budget is not None and budget.refill() <= 0
+
+    # ---------- API ----------
+    def admit(self, guild_id: Optional[int]) -> Ticket:
+        level = self.current_level()
+        if self._over_budget(guild_id):
+            # A guild that spent its budget gets the cheap path; one far
+            # past it (a full minute of debt) is told to wait.
+            budget = self._budgets[guild_id]
+            level = max(level, Level.BUSY if budget.tokens <= -budget.capacity else Level.CHEAP_MODEL)
+        metrics.registry.inc("agent_admission_total", help="Mentions admitted per level.", level=level.name)
+        metrics.registry.set("agent_admission_load", self.load(), help="Admission load (1.0 = at capacity).")
+        return Ticket(self, guild_id, level)
+
+    def charge(self, guild_id: Optional[int], tokens: int):
+        if not self.guild_tokens_per_min or guild_id is None:
+            return
+        budget = self._budgets.get(guild_id)
+        if budget is None:
+            budget = self._budgets[guild_id] = _GuildBudget(self.guild_tokens_per_min)
+        budget.refill()
+        budget.tokens -= tokens
+
+    async def run_model(self, fn, *args, **kwargs):
+        start = time.monotonic()
+        async with self._model_slots:
+            self._observe_wait(time.monotonic() - start)
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+admission = AdmissionController()
@@ -0,0 +1,116 @@
+# app.py
+"""
+Application bootstrap. Nothing here runs at import time: clients and storage
+are created on first use, and ``warm_up()`` (called from the bot's
+``setup_hook``) builds them in parallel before the gateway connects.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv  # pip install python-dotenv
+
+import metrics
+import storage
+from memory import Memory, get_client as get_gemini_client
+
+load_dotenv()  # reads .env in project root
+
+MEMORY_MAX_CHARS = int(os.getenv("MEMORY_MAX_CHARS", "6000"))
+
+_lock = threading.Lock()
+_memory: Optional[Memory] = None
+_openai_client = None
+
+
+def check_config():
+    """Fail fast on missing credentials; call before connecting to Discord."""
+    if not os.getenv("OPENAI_API_KEY"):
+        raise RuntimeError("Missing OpenAI API key. Set OPENAI_API_KEY.")
+    if not os.getenv("YOUR_API_KEY"):
+        raise RuntimeError("Missing Gemini API key. Set YOUR_API_KEY.")
+
+
+def parse_shard_ids(spec: str) -> List[int]:
+    """Parse "0,1,2" or "0-3" (or a mix, "0-3,8") into shard ids."""
+    ids: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            ids.extend(range(int(lo), int(hi) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def shard_config() -> Dict[str, Any]:
+    """
+    AutoShardedBot arguments from SHARD_COUNT / SHARD_IDS. Empty means
+    discord.py picks the shard count and runs every shard in this process.
+    """
+    count = os.getenv("SHARD_COUNT")
+    if not count:
+        return {}
+    config: Dict[str, Any] = {"shard_count": int(count)}
+    ids = os.getenv("SHARD_IDS")
+    if ids:
+        config["shard_ids"] = parse_shard_ids(ids)
+    return config
+
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("Missing OpenAI API key. Set OPENAI_API_KEY.")
+                from openai import OpenAI
+
+                _openai_client = OpenAI(api_key=api_key)
+    return _openai_client
+
+
+def get_memory() -> Memory:
+    """Memory uses the configured storage backend for AI interactions."""
+    global _memory
+    if _memory is None:
+        with _lock:
+            if _memory is None:
+                _memory = Memory(max_chars=MEMORY_MAX_CHARS)
+    return _memory
+
+
+def _timed(name: str, fn):
+    def run():
+        start = time.perf_counter()
+        fn()
+        metrics.registry.observe(
+            "agent_startup_seconds",
+            time.perf_counter() - start,
+            help="Time to initialize each component at startup.",
+            component=name,
+        )
+    return run
+
+
+async def warm_up():
+    """Create storage, schemas and API clients concurrently."""
+    import logger
+
+    def storage_and_schema():
+        storage.get_backend()
+        logger.ensure_schema()
+
+    steps = [_timed("storage", storage_and_schema), _timed("memory", get_memory)]
+    if os.getenv("OPENAI_API_KEY"):
+        steps.append(_timed("openai", get_openai_client))
+    if os.getenv("YOUR_API_KEY"):
+        steps.append(_timed("gemini", get_gemini_client))
+    await asyncio.gather(*(asyncio.to_thread(step) for step in steps))
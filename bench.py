@@ -0,0 +1,142 @@
+# bench.py
+"""
+Benchmarks: the same logger/Memory workload against each storage backend,
+and process cold-start time.
+
+    python bench.py sqlite              # temporary SQLite file
+    python bench.py postgres sqlite     # DATABASE_URL (use a scratch database!)
+    python bench.py --cold-start        # `import bot` and bootstrap, fresh interpreters
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import storage
+
+
+def _fake_message(i: int, channel_id: int = 1000, guild_id: int = 1):
+    author = SimpleNamespace(id=10 + i % 5, name=f"user{i % 5}", display_name=f"User {i % 5}", bot=False)
+    return SimpleNamespace(
+        id=10_000 + i,
+        channel=SimpleNamespace(id=channel_id),
+        guild=SimpleNamespace(id=guild_id),
+        author=author,
+        content=f"benchmark message {i} about deploys, tests and the release plan",
+        reference=None,
+    )
+
+
+def _timed(fn: Callable[[int], None], n: int) -> List[float]:
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "ops": len(samples),
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "ops_per_s": len(samples) / sum(samples) if sum(samples) else float("inf"),
+    }
+
+
+def run_storage_workload(backend: storage.StorageBackend, n: int) -> Dict[str, Dict[str, float]]:
+    import logger
+    from memory import Memory
+
+    storage.set_backend(backend)
+    logger.ensure_schema()
+    memory = Memory(max_chars=10**9, backend=backend)
+    key = f"bench:{time.time_ns()}"
+    probe = _fake_message(0)
+
+    return {
+        "log_message": _summary(_timed(lambda i: logger.log_message(_fake_message(i)), n)),
+        "fetch_recent_history": _summary(
+            _timed(lambda i: logger.fetch_recent_history_for_scope(probe, limit=60, minutes=240), n)
+        ),
+        "add_turn": _summary(_timed(lambda i: memory.add_turn(key, "user", f"turn {i}"), n)),
+        "get_thread": _summary(_timed(lambda i: memory.get_thread(key), n)),
+        "add_fact": _summary(_timed(lambda i: memory.add_fact(42, f"fact {i}"), n)),
+        "get_facts": _summary(_timed(lambda i: memory.get_facts(42), n)),
+    }
+
+
+_COLD_START_SNIPPETS = {
+    "import_bot": "import bot",
+    "import_bot+warm_up": "import asyncio, bot, app; asyncio.run(app.warm_up())",
+}
+
+
+def measure_cold_start(tmpdir: str, runs: int) -> Dict[str, Dict[str, float]]:
+    """Time each snippet in a fresh interpreter against a throwaway SQLite file."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(tmpdir, "cold.sqlite3"))
+    results = {}
+    for name, snippet in _COLD_START_SNIPPETS.items():
+        code = (
+            "import time; _t = time.perf_counter()\n"
+            f"{snippet}\n"
+            "print(time.perf_counter() - _t)"
+        )
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", code], cwd=here, env=env, capture_output=True, text=True, check=True
+            )
+            samples.append(float(out.stdout.strip().splitlines()[-1]))
+        results[name] = _summary(samples)
+    return results
+
+
+def _make_backend(kind: str, tmpdir: str) -> storage.StorageBackend:
+    if kind == "sqlite":
+        return storage.SQLiteBackend(os.path.join(tmpdir, "bench.sqlite3"))
+    return storage.create_backend(kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("backends", nargs="*", metavar="{postgres,sqlite}")
+    parser.add_argument("-n", type=int, default=500, help="operations per step")
+    parser.add_argument("--cold-start", action="store_true", help="measure startup in fresh interpreters")
+    parser.add_argument("--runs", type=int, default=5, help="interpreter launches per cold-start snippet")
+    args = parser.parse_args()
+    if not args.backends and not args.cold_start:
+        parser.error("pick at least one backend or --cold-start")
+    for kind in args.backends:
+        if kind not in ("postgres", "sqlite"):
+            parser.error(f"unknown backend {kind!r}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.cold_start:
+            print("== cold start")
+            for step, s in measure_cold_start(tmpdir, args.runs).items():
+                print(f"  {step:<22} p50={s['p50_ms']:8.3f}ms  p99={s['p99_ms']:8.3f}ms")
+        for kind in args.backends:
+            backend = _make_backend(kind, tmpdir)
+            try:
+                results = run_storage_workload(backend, args.n)
+            finally:
+                backend.close()
+            print(f"== {kind}")
+            for step, s in results.items():
+                print(
+                    f"  {step:<22} p50={s['p50_ms']:8.3f}ms  p99={s['p99_ms']:8.3f}ms  "
+                    f"{s['ops_per_s']:10.1f} ops/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,77 @@
+import asyncio
 import io
 import discord
 from discord import File, Embed
 from discord.ext import commands
-from openai import OpenAI
 from dotenv import load_dotenv  # pip install python-dotenv
 import os
+from functools import lru_cache
 from typing import Any
 
-from memory import Memory
-from textwrap import wrap
+from app import get_memory, get_openai_client, shard_config, warm_up
 from logger import log_message, fetch_recent_history_for_scope, log_message,fetch_user_recent_in_channel,fetch_user_recent_in_guild
 import logger #part of local py files
+import capture
+import metrics
+import sql_tool
+from outbound import outbox
+from admission import BUSY_REPLY, Level, admission, estimate_tokens
 
 
 
 
 load_dotenv()  # reads .env in project root
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if not OPENAI_API_KEY:
-    raise RuntimeError("Missing OpenAI API key. Set OPENAI_API_KEY.")
 
+intents = discord.Intents.default()
+intents.message_content = True
+intents.guilds = True
 
 
+class AgentBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Build storage, schemas and API clients before the gateway connects.
+        await warm_up()
+        capture.start()
+        self.loop.create_task(run_search_indexer())
+        self.loop.create_task(run_fact_queue())
 
+    async def close(self):
+        # Deliver queued replies before the connection goes away.
+        await outbox.close(timeout=10.0)
+        capture.stop()
+        await super().close()
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.guilds = True
 
+async def run_search_indexer(batch_size: int = 2000, idle_seconds: float = 5.0):
+    """Keep the message search index caught up in the background."""
+    while True:
+        try:
+            indexed = await asyncio.to_thread(logger.index_pending_messages, batch_size)
+        except Exception as exc:
+            print(f"Search indexer error: {exc}")
+            indexed = 0
+        # Keep draining a backlog; otherwise wait for new messages.
+        await asyncio.sleep(0 if indexed >= batch_size else idle_seconds)
+
+
+async def run_fact_queue(batches: int = 5, idle_seconds: float = 30.0):
+    """Extract facts from imported history, only while the bot is not under load."""
+    while True:
+        drained = 0
+        if admission.current_level() == Level.FULL:
+            try:
+                drained = await asyncio.to_thread(get_memory().drain_fact_queue, batches)
+            except Exception as exc:
+                print(f"Fact queue error: {exc}")
+        await asyncio.sleep(1.0 if drained else idle_seconds)
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-memory = Memory(max_chars=6000)  # uses PostgreSQL for AI interactions
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+bot = AgentBot(command_prefix="!", intents=intents, **shard_config())
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-nano")
+# Used instead of OPENAI_MODEL when admission control sheds load.
+OPENAI_CHEAP_MODEL = os.getenv("OPENAI_CHEAP_MODEL", OPENAI_MODEL)
 OPENAI_MCP_POSTGRES_SERVER_URL = os.getenv("OPENAI_MCP_POSTGRES_SERVER_URL")
 OPENAI_MCP_POSTGRES_LABEL = os.getenv("OPENAI_MCP_POSTGRES_LABEL", "postgres")
 OPENAI_MCP_POSTGRES_DESCRIPTION = os.getenv(
@@ -53,10 +88,22 @@ OPENAI_MCP_POSTGRES_ALLOWED_TOOLS = [
     for tool in os.getenv("OPENAI_MCP_POSTGRES_ALLOWED_TOOLS", "").split(",")
     if tool.strip()
 ]
+# "mcp" attaches the remote MCP server, "local" exposes sql_tool's
+# query_database function run through our own storage backend, "off" neither.
+OPENAI_SQL_TOOL_MODE = os.getenv(
+    "OPENAI_SQL_TOOL_MODE",
+    "mcp" if OPENAI_MCP_POSTGRES_SERVER_URL else "off",
+).lower()
+# Upper bound on model -> query_database -> model round trips per reply.
+OPENAI_SQL_TOOL_MAX_ROUNDS = int(os.getenv("OPENAI_SQL_TOOL_MAX_ROUNDS", "4"))
 
 
+@lru_cache(maxsize=1)
 def build_openai_tools() -> list[dict[str, Any]]:
-    if not OPENAI_MCP_POSTGRES_SERVER_URL:
+    """Tool list for responses.create; built once, do not mutate."""
+    if OPENAI_SQL_TOOL_MODE == "local":
+        return [sql_tool.TOOL_DEFINITION]
+    if OPENAI_SQL_TOOL_MODE != "mcp" or not OPENAI_MCP_POSTGRES_SERVER_URL:
         return []
 
     tool: dict[str, Any] = {
@@ -73,21 +120,64 @@ def build_openai_tools() -> list[dict[str, Any]]:
     return [tool]
 
 
-def generate_text(prompt: str, system_instruction: str | None = None) -> str:
-    response = openai_client.responses.create(
-        model=OPENAI_MODEL,
-        instructions=system_instruction,
-        input=prompt,
-        tools=build_openai_tools() or None,
-    )
+def generate_text(
+    prompt: str,
+    system_instruction: str | None = None,
+    task: str = "reply",
+    model: str | None = None,
+) -> str:
+    model = model or OPENAI_MODEL
+    client = get_openai_client()
+    tools = build_openai_tools() or None
+    with metrics.llm_call("openai", task) as usage:
+        usage["prompt"] = prompt
+        response = client.responses.create(
+            model=model,
+            instructions=system_instruction,
+            input=prompt,
+            tools=tools,
+        )
+        _add_usage(usage, response)
+        # Local SQL tool: run the model's queries ourselves and hand back results.
+        for _ in range(OPENAI_SQL_TOOL_MAX_ROUNDS):
+            calls = [
+                item for item in response.output
+                if item.type == "function_call" and item.name == sql_tool.TOOL_NAME
+            ]
+            if not calls:
+                break
+            with metrics.span("sql_tool"):
+                outputs = [
+                    {
+                        "type": "function_call_output",
+                        "call_id": call.call_id,
+                        "output": sql_tool.run_tool_call(call.arguments),
+                    }
+                    for call in calls
+                ]
+            response = client.responses.create(
+                model=model,
+                instructions=system_instruction,
+                previous_response_id=response.id,
+                input=outputs,
+                tools=tools,
+            )
+            _add_usage(usage, response)
+        usage["response"] = response.output_text
     return response.output_text or "(no content)"
 
+def _add_usage(usage: dict, response):
+    if response.usage is not None:
+        usage["input"] += response.usage.input_tokens or 0
+        usage["output"] += response.usage.output_tokens or 0
+
 def summarize(text: str, limit=800):
     summary = generate_text(
         prompt=(
             "Summarize the following conversation into compact notes "
             f"(<= {limit} characters). Keep user goals/preferences and unresolved tasks.\n\n{text}"
-        )
+        ),
+        task="summarize",
     )
     return summary[:limit]
 
@@ -130,7 +220,15 @@ async def conversation_key(message: discord.Message) -> str:
 
 
 
-def build_prompt(author_id: int, thread, guild, ambient_lines: list[str], targets: dict[int, list[str]]):
+def build_prompt(
+    author_id: int,
+    thread,
+    guild,
+    ambient_lines: list[str],
+    targets: dict[int, list[str]],
+    related_lines: list[str] | None = None,
+):
+    memory = get_memory()
     user_facts = memory.get_facts(author_id)
     team_facts = memory.get_team_facts(guild.id) if guild and hasattr(memory, "get_team_facts") else []
 
@@ -140,8 +238,8 @@ def build_prompt(author_id: int, thread, guild, ambient_lines: list[str], target
     preface = (
         "You are a helpful Discord assistant. Be concise. "
         "Ask follow-up questions only when necessary.\n"
-        "If database MCP tools are available, use them when the user asks for factual data "
-        "that should come from PostgreSQL instead of guessing.\n\n"
+        "If database tools are available, use them when the user asks for factual data "
+        "that should come from the database instead of guessing.\n\n"
     )
     blocks = []
     if team_facts:
@@ -152,6 +250,8 @@ def build_prompt(author_id: int, thread, guild, ambient_lines: list[str], target
         blocks.append(f"Conversation summary so far:\n{thread['summary']}")
     if ambient:
         blocks.append("Context from recent untagged discussion in this thread/channel:\n" + ambient)
+    if related_lines:
+        blocks.append("Older messages in this thread/channel matching the question:\n" + "\n".join(related_lines))
 
     # NEW: include per-mentioned-user context
     if targets:
@@ -163,12 +263,8 @@ def build_prompt(author_id: int, thread, guild, ambient_lines: list[str], target
     return preface + header + "Recent tagged exchange (if any):\n" + recent_turns + "\nAssistant:"
 
 
-def get_response_from_ai(prompt: str) -> str:
-    return generate_text(prompt, system_instruction="Limit response 2000 chars") or "(no content)"
-
-async def safe_send(channel, text: str):
-    for chunk in wrap(text, 2000, replace_whitespace=False, drop_whitespace=False):
-        await channel.send(chunk, allowed_mentions=discord.AllowedMentions.none())
+def get_response_from_ai(prompt: str, model: str | None = None) -> str:
+    return generate_text(prompt, system_instruction="Limit response 2000 chars", model=model) or "(no content)"
 
 # Optional: let users store long-term facts
 @bot.command(name="remember")
@@ -177,7 +273,7 @@ async def remember(ctx, *, fact: str):
     if not cleaned:
         await ctx.reply("Please provide a fact to remember.")
         return
-    memory.add_fact(ctx.author.id, cleaned)
+    get_memory().add_fact(ctx.author.id, cleaned)
     await ctx.reply("Noted. I'll remember that.")
 
 @bot.command(name="remember_team")
@@ -189,47 +285,85 @@ async def remember_team(ctx, *, fact: str):
     if not cleaned:
         await ctx.reply("Please provide a team fact to remember.")
         return
-    memory.add_team_fact(ctx.guild.id, cleaned)
+    get_memory().add_team_fact(ctx.guild.id, cleaned)
     await ctx.reply("Got it. I'll remember this for the team.")
 
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user}")
+    metrics.start_http_server()
+    print(f"Logged in as {bot.user} (shards {sorted(bot.shards)} of {bot.shard_count})")
 
 @bot.event
 async def on_message(message: discord.Message):
-    log_message(message)
-    if message.author == bot.user:
+    mentioned = bot.user in message.mentions
+    with metrics.request("mention" if mentioned else "message", message_id=str(message.id)) as trace, \
+            capture.event(message, mentioned, bot.user, trace):
+        await _handle_message(message, bot.user, mentioned)
+        await bot.process_commands(message)
+
+async def _handle_message(message: discord.Message, self_user, mentioned: bool):
+    """Everything on_message does except command dispatch; replay.py drives this directly."""
+    memory = get_memory()
+    with metrics.span("log_message"):
+        log_message(message)
+    if message.author == self_user:
         return
     try:
         if not message.author.bot:
-            memory.record_message_for_facts(
-                message.author.id,
-                message.guild.id if message.guild else None,
-                message.content,
-                batch_size=30,
-            )
+            with metrics.span("record_facts"):
+                # Extraction calls the model when a batch fills; keep it off the event loop.
+                await asyncio.to_thread(
+                    memory.record_message_for_facts,
+                    message.author.id,
+                    message.guild.id if message.guild else None,
+                    message.content,
+                    batch_size=30,
+                    defer=admission.current_level() >= Level.DEFER_FACTS,
+                )
     except Exception:
         pass
 
-    if bot.user in message.mentions:
-        key = await conversation_key(message)
-        memory.add_turn(key, "user", message.content)
-
-        # summarize if large
+    if mentioned:
+        ticket = admission.admit(message.guild.id if message.guild else None)
+        if ticket.level >= Level.BUSY:
+            outbox.enqueue(message.channel, BUSY_REPLY)
+        else:
+            with ticket:
+                await _reply_to_mention(message, memory, ticket, self_user)
+
+async def _reply_to_mention(message: discord.Message, memory, ticket, self_user):
+    level = ticket.level
+    key = await conversation_key(message)
+    # add_turn may summarize the thread through Gemini, so it counts as a model call.
+    with metrics.span("add_turn"):
+        await ticket.run_model(memory.add_turn, key, "user", message.content)
+
+    # summarize if large
+    with metrics.span("get_thread"):
         thread = memory.get_thread(key)
-        joined = "\n".join(f"{t['role']}: {t['text']}" for t in thread["turns"])
-        if len(joined) > memory.max_chars:
-            s = summarize(joined, limit=800)
+    joined = "\n".join(f"{t['role']}: {t['text']}" for t in thread["turns"])
+    if len(joined) > memory.max_chars:
+        with metrics.span("summarize"):
+            s = await ticket.run_model(summarize, joined, limit=800)
             memory.save_thread(key, {"summary": s})
             thread = memory.get_thread(key)
 
+    ambient: list[str] = []
+    related: list[str] = []
+    targets: dict[int, list[str]] = {}
+    # Under load (level >= NO_CONTEXT) reply from thread memory alone.
+    if level < Level.NO_CONTEXT:
         # Ambient channel/thread context (untagged)
-        ambient = fetch_recent_history_for_scope(message, limit=60, minutes=240)
+        with metrics.span("fetch_ambient"):
+            ambient = fetch_recent_history_for_scope(message, limit=60, minutes=240)
+
+        # Keyword-matched history older than the ambient window
+        with metrics.span("fetch_related"):
+            related = logger.fetch_relevant_history(message, limit=15, exclude_minutes=240)
 
-        # NEW: pull context for any other @mentions (besides the bot)
-        targets: dict[int, list[str]] = {}
-        other_mentions = [u for u in message.mentions if u.id != bot.user.id]
+    # NEW: pull context for any other @mentions (besides the bot)
+    other_mentions = [] if level >= Level.NO_CONTEXT else [u for u in message.mentions if u.id != self_user.id]
+    with metrics.span("fetch_mentions"):
         for u in other_mentions:
             # first try same channel/thread
             lines = fetch_user_recent_in_channel(message.channel.id, u.id, minutes=720, limit=60)
@@ -238,17 +372,21 @@ async def on_message(message: discord.Message):
                 lines = fetch_user_recent_in_guild(message.guild.id, u.id, minutes=720, limit=100)
             targets[u.id] = lines
 
-        prompt = build_prompt(message.author.id, thread, message.guild, ambient, targets)
+    with metrics.span("build_prompt"):
+        prompt = build_prompt(message.author.id, thread, message.guild, ambient, targets, related)
+    ticket.charge(estimate_tokens(prompt))
 
-        try:
-            reply = get_response_from_ai(prompt)
-        except Exception:
-            reply = ("I'm having trouble reaching the model right now. "
-                     "Please try again in a moment.")
-
-        if reply:
-            memory.add_turn(key, "assistant", reply)
-            await safe_send(message.channel, reply)
-
-    await bot.process_commands(message)
+    model = OPENAI_CHEAP_MODEL if level >= Level.CHEAP_MODEL else OPENAI_MODEL
+    try:
+        with metrics.span("model_call"):
+            reply = await ticket.run_model(get_response_from_ai, prompt, model)
+    except Exception:
+        reply = ("I'm having trouble reaching the model right now. "
+                 "Please try again in a moment.")
+
+    if reply:
+        with metrics.span("add_turn"):
+            await ticket.run_model(memory.add_turn, key, "assistant", reply)
+        # Queued for the channel's sender task; no waiting on Discord here.
+        outbox.enqueue(message.channel, reply)
     
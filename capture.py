@@ -0,0 +1,242 @@
+# capture.py
+"""
+Production traffic capture for offline replay (see replay.py).
+
+With CAPTURE_PATH set, each handled message is appended to a JSONL stream
+(gzip-compressed when the path ends in .gz) along with the database
+statements and LLM calls it caused:
+
+    {"type": "start", "t": ..., "pid": ...}            once per process
+    {"type": "message", "seq": 1, "t": ..., ...}       the incoming event
+    {"type": "sql", "id": "3f2a...", "sql": "..."}     first sighting of a statement
+    {"type": "query", "seq": 1, "id": "3f2a...", "ms": 0.41, "ok": true}
+    {"type": "llm", "seq": 1, "provider": "openai", "n": 0, "response": "...", ...}
+    {"type": "done", "seq": 1, "total_ms": ..., "db_queries": ..., ...}
+
+Ids become keyed hashes (CAPTURE_SALT), author names become pseudonyms, and
+emails, URLs, long numbers and token-like strings are scrubbed from message
+text and model output. Prompts are kept only as a hash and a length.
+Use "{pid}" in CAPTURE_PATH to give each worker process its own file.
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
+
+_SCRUB_RE = re.compile(
+    r"(?P<mention><(?P<sigil>@[!&]?|#)(?P<id>\d+)>)"
+    r"|(?P<secret>\b(?:sk|pk|rk|ghp|gho|ghs|xox[abprs])[-_][A-Za-z0-9_-]{10,}"
+    r"|[\w-]{24,}\.[\w-]{6}\.[\w-]{27,}|\b[A-Za-z0-9+/_-]{32,}={0,2})"
+    r"|(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)"
+    r"|(?P<url>\bhttps?://\S+)"
+    r"|(?P<number>\b\d{9,}\b)"
+)
+
+
+class Recorder:
+    """Append-only capture file; safe to call from any thread."""
+
+    def __init__(self, path: str, salt: str = CAPTURE_SALT):
+        self.path = path.format(pid=os.getpid())
+        self._key = hashlib.sha256(salt.encode("utf-8")).digest()
+        opener = gzip.open if self.path.endswith(".gz") else open
+        self._fh = opener(self.path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._seen_sql: set = set()
+        self._last_flush = time.monotonic()
+        self.write({"type": "start", "t": round(time.time(), 3), "pid": os.getpid()})
+
+    # ---------- redaction ----------
+    def pseudo_id(self, value: Any) -> Optional[int]:
+        """Stable 56-bit stand-in for a Discord id."""
+        if value is None:
+            return None
+        digest = hashlib.blake2b(str(value).encode("utf-8"), key=self._key, digest_size=7).digest()
+        return int.from_bytes(digest, "big")
+
+    def redact(self, text: Optional[str]) -> Optional[str]:
+        if text is None:
+            return None
+
+        def sub(match: re.Match) -> str:
+            if match.group("mention"):
+                return f"<{match.group('sigil')}{self.pseudo_id(match.group('id'))}>"
+            for kind in ("secret", "email", "url", "number"):
+                if match.group(kind):
+                    return f"<{kind}>"
+            return match.group(0)
+
+        return _SCRUB_RE.sub(sub, text)
+
+    # ---------- output ----------
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            now = time.monotonic()
+            if now - self._last_flush >= 1.0:
+                self._fh.flush()
+                self._last_flush = now
+
+    def next_seq(self) -> int:
+        with self._lock:
+            return next(self._seq)
+
+    def sql_id(self, sql: str) -> str:
+        fid, text = _fingerprint(sql)
+        if fid not in self._seen_sql:
+            with self._lock:
+                first = fid not in self._seen_sql
+                self._seen_sql.add(fid)
+            if first:
+                self.write({"type": "sql", "id": fid, "sql": text})
+        return fid
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+@lru_cache(maxsize=1024)
+def _fingerprint(sql: str) -> Tuple[str, str]:
+    text = re.sub(r"\s+", " ", sql).strip()
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=6).hexdigest(), text
+
+
+class EventScope:
+    """The event being handled (or replayed); numbers its LLM calls per provider."""
+
+    def __init__(self, seq: Any):
+        self.seq = seq
+        self._calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def next_call(self, provider: str) -> int:
+        with self._lock:
+            n = self._calls.get(provider, 0)
+            self._calls[provider] = n + 1
+            return n
+
+
+recorder: Optional[Recorder] = None
+_scope: ContextVar[Optional[EventScope]] = ContextVar("capture_event", default=None)
+
+
+def start(path: Optional[str] = CAPTURE_PATH) -> Optional[Recorder]:
+    """Open the capture file if CAPTURE_PATH is set; a no-op otherwise."""
+    global recorder
+    if path and recorder is None:
+        recorder = Recorder(path)
+        print(f"Capturing traffic to {recorder.path}")
+    return recorder
+
+
+def stop():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+def current_scope() -> Optional[EventScope]:
+    return _scope.get()
+
+
+@contextmanager
+def bind(seq: Any):
+    """Attribute work in this context to event ``seq`` (used by replay)."""
+    scope = EventScope(seq)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def _reply_root(message) -> Any:
+    cur = message
+    while cur.reference and cur.reference.resolved:
+        cur = cur.reference.resolved
+    return cur.id if cur is not message else None
+
+
+@contextmanager
+def event(message, mentioned: bool, self_user, trace=None):
+    """
+    Record one incoming message and, on exit, how long it took (from the
+    metrics ``trace``). Free when capture is off.
+    """
+    rec = recorder
+    if rec is None:
+        yield
+        return
+    seq = rec.next_seq()
+    author = message.author
+    reference = message.reference
+    rec.write({
+        "type": "message",
+        "seq": seq,
+        "t": round(time.time(), 3),
+        "id": rec.pseudo_id(message.id),
+        "channel": rec.pseudo_id(message.channel.id),
+        "guild": rec.pseudo_id(message.guild.id) if message.guild else None,
+        "author": rec.pseudo_id(author.id),
+        "author_name": f"user-{rec.pseudo_id(author.id) % 10**6:06d}",
+        "bot": bool(author.bot),
+        "self": author == self_user,
+        "mentioned": mentioned,
+        "mentions": [rec.pseudo_id(u.id) for u in message.mentions if u != self_user],
+        "reference": rec.pseudo_id(reference.message_id) if reference and reference.message_id else None,
+        "root": rec.pseudo_id(_reply_root(message)),
+        "content": rec.redact(message.content or ""),
+    })
+    with bind(seq):
+        try:
+            yield
+        finally:
+            done: Dict[str, Any] = {"type": "done", "seq": seq}
+            if trace is not None:
+                summary = trace.as_dict()
+                for field in ("total_ms", "spans_ms", "db_queries", "db_ms"):
+                    done[field] = summary[field]
+            rec.write(done)
+
+
+def record_query(sql: str, elapsed: float, ok: bool):
+    rec, scope = recorder, _scope.get()
+    if rec is None or scope is None:
+        return
+    rec.write({"type": "query", "seq": scope.seq, "id": rec.sql_id(sql), "ms": round(elapsed * 1000, 3), "ok": ok})
+
+
+def record_llm(provider: str, task: str, elapsed: float, usage: Dict[str, Any], ok: bool):
+    rec, scope = recorder, _scope.get()
+    if rec is None or scope is None:
+        return
+    prompt = usage.get("prompt") or ""
+    rec.write({
+        "type": "llm",
+        "seq": scope.seq,
+        "provider": provider,
+        "task": task,
+        "n": scope.next_call(provider),
+        "ms": round(elapsed * 1000, 3),
+        "ok": ok,
+        "input": usage["input"],
+        "output": usage["output"],
+        "prompt_sha": hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16],
+        "prompt_chars": len(prompt),
+        "response": rec.redact(usage.get("response")),
+    })
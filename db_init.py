@@ -1,10 +1,11 @@
-from db_postgres import get_connection
+from sql_tool import SQL_TOOL_ALLOWED_TABLES
+from storage import get_backend
 
 
 def create_tables():
     """
-    Initialize PostgreSQL tables matching the prior SQLite schemas used for
-    memory and message logging.
+    Initialize the memory and message-logging tables on the configured
+    storage backend (PostgreSQL by default, see STORAGE_BACKEND).
     """
     statements = [
         """
@@ -59,10 +60,26 @@ def create_tables():
         "CREATE INDEX IF NOT EXISTS idx_msgs_channel_time ON messages(channel_id, created_at)",
         "CREATE INDEX IF NOT EXISTS idx_msgs_message_id ON messages(message_id)",
         "CREATE INDEX IF NOT EXISTS idx_msgs_reference_id ON messages(reference_id)",
+        """
+        CREATE TABLE IF NOT EXISTS fact_queue (
+            id       BIGSERIAL PRIMARY KEY,
+            user_id  TEXT,
+            guild_id TEXT,
+            text     TEXT NOT NULL,
+            ts       DOUBLE PRECISION NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS import_progress (
+            source     TEXT PRIMARY KEY,
+            records    BIGINT NOT NULL,
+            updated_at DOUBLE PRECISION NOT NULL
+        )
+        """,
     ]
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            for stmt in statements:
-                cur.execute(stmt)
-    print("PostgreSQL tables are ready.")
+    backend = get_backend()
+    backend.execute_script(statements)
+    backend.ensure_search_schema()
+    backend.ensure_readonly_role(SQL_TOOL_ALLOWED_TABLES)
+    print(f"{backend.name} tables are ready.")
@@ -1,6 +1,4 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
 
 def get_database_url() -> str:
@@ -12,12 +10,3 @@ def get_database_url() -> str:
     if not url:
         raise RuntimeError("DATABASE_URL environment variable is not set")
     return url
-
-
-def get_connection():
-    """
-    Open a new connection to the PostgreSQL database.
-    RealDictCursor lets you get rows as dictionaries if you want that.
-    """
-    url = get_database_url()
-    return psycopg2.connect(url, cursor_factory=RealDictCursor)
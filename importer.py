@@ -0,0 +1,459 @@
+# importer.py
+"""
+Bulk offline importer for historical Discord message exports.
+
+    python importer.py export.json                       # DiscordChatExporter JSON
+    python importer.py dump.jsonl --channel-id 123 --guild-id 456
+    python importer.py channel.csv --channel-id 123 --queue-facts --index
+
+Files are streamed, so memory stays flat regardless of export size. Rows go
+into ``messages`` in batches (COPY + one set-based insert on Postgres, one
+executemany on SQLite); rows whose message_id already exists are skipped, so
+re-running an import is harmless. Each batch commits together with the
+file's resume point, and a restarted import skips what was already loaded.
+
+``--queue-facts`` groups non-bot messages per author and per guild (like the
+live buffers in Memory.record_message_for_facts) and queues the batches for
+the bot to extract in the background while it is idle. ``--index`` brings
+the full-text search index up to date before exiting.
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv  # pip install python-dotenv
+
+load_dotenv()  # reads .env in project root
+
+import logger  # noqa: E402  (reads STORAGE_BACKEND / DATABASE_URL from .env)
+from storage import StorageBackend, get_backend  # noqa: E402
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS import_progress (
+        source     TEXT PRIMARY KEY,
+        records    BIGINT NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fact_queue (
+        id       BIGSERIAL PRIMARY KEY,
+        user_id  TEXT,
+        guild_id TEXT,
+        text     TEXT NOT NULL,
+        ts       DOUBLE PRECISION NOT NULL
+    )
+    """,
+]
+
+# Most authors are tracked at once for fact batches; the least recently seen
+# one is queued early when this is exceeded.
+MAX_TRACKED_AUTHORS = 10_000
+
+_CSV_ALIASES = {
+    "id": "message_id",
+    "messageid": "message_id",
+    "channelid": "channel_id",
+    "guildid": "guild_id",
+    "authorid": "author_id",
+    "userid": "author_id",
+    "author": "author_name",
+    "authorname": "author_name",
+    "username": "author_name",
+    "content": "content",
+    "message": "content",
+    "isbot": "is_bot",
+    "bot": "is_bot",
+    "referenceid": "reference_id",
+    "replyto": "reference_id",
+    "date": "created_at",
+    "timestamp": "created_at",
+    "createdat": "created_at",
+}
+
+_MESSAGES_KEY_RE = re.compile(r'"messages"\s*:\s*\[')
+
+_DATE_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%d-%b-%y %I:%M %p",
+    "%m/%d/%Y %I:%M %p",
+    "%m/%d/%Y %H:%M",
+)
+
+
+# ---------- readers ----------
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    ext = os.path.splitext(name)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    return "json"
+
+
+def _iter_json(fh, header: Dict[str, Any], chunk_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """
+    Stream messages from a DiscordChatExporter file ({"guild": ...,
+    "channel": ..., "messages": [...]}) or a top-level array, decoding one
+    object at a time. Fields before "messages" are parsed into ``header``.
+    """
+    decoder = json.JSONDecoder()
+    buf = fh.read(chunk_size)
+    pos = len(buf) - len(buf.lstrip())
+    if buf[pos:pos + 1] == "[":
+        pos += 1
+    else:
+        # The top-level key is the first "messages": [ whose prefix parses as
+        # the header object; a string value such as a channel named
+        # "messages" is not followed by a colon, and a key nested in a
+        # header field leaves the prefix unbalanced.
+        start = 0
+        while True:
+            match = _MESSAGES_KEY_RE.search(buf, start)
+            if match is None:
+                more = fh.read(chunk_size)
+                if not more:
+                    raise ValueError('no top-level "messages" array found')
+                buf += more
+                continue
+            try:
+                parsed = json.loads(buf[:match.start()].rstrip().rstrip(",") + "}")
+            except ValueError:
+                start = match.start() + 1
+                continue
+            if isinstance(parsed, dict):
+                break
+            start = match.start() + 1
+        header.update(parsed)
+        pos = match.end()
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            more = fh.read(chunk_size)
+            if not more:
+                return
+            buf, pos = more, 0
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            more = fh.read(chunk_size)
+            if not more:
+                raise
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield obj
+        pos = end
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def _iter_jsonl(fh) -> Iterator[Dict[str, Any]]:
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _iter_csv(fh) -> Iterator[Dict[str, Any]]:
+    csv.field_size_limit(2**31 - 1)
+    reader = csv.DictReader(fh)
+    fields = {
+        name: _CSV_ALIASES.get("".join(ch for ch in name.lower() if ch.isalnum()))
+        for name in reader.fieldnames or []
+    }
+    for row in reader:
+        yield {fields[k]: v for k, v in row.items() if fields.get(k)}
+
+
+# ---------- normalization ----------
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """ISO-8601, epoch seconds/milliseconds or a few exporter formats, as UTC."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) or str(value).replace(".", "", 1).isdigit():
+        seconds = float(value)
+        if seconds > 1e11:  # milliseconds
+            seconds /= 1000
+        return datetime.fromtimestamp(seconds, timezone.utc)
+    text = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in _DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "t", "yes", "y")
+    return bool(value)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None or value == "" else str(value)
+
+
+def normalize(rec: Dict[str, Any], channel_id: Optional[str], guild_id: Optional[str]) -> Optional[Tuple]:
+    """
+    One export record -> a row in storage.IMPORT_COLUMNS order, or None if
+    it lacks an author, channel or timestamp. Accepts DiscordChatExporter
+    messages (nested author/reference) and flat records.
+    """
+    author = rec.get("author")
+    if isinstance(author, dict):
+        author_id = _text(author.get("id"))
+        author_name = author.get("nickname") or author.get("name")
+        is_bot = _flag(author.get("isBot"))
+    else:
+        author_id = _text(rec.get("author_id"))
+        author_name = rec.get("author_name") or (author if isinstance(author, str) else None)
+        is_bot = _flag(rec.get("is_bot"))
+    reference = rec.get("reference")
+    reference_id = _text(reference.get("messageId") if isinstance(reference, dict) else rec.get("reference_id"))
+    created_at = parse_timestamp(rec.get("timestamp") or rec.get("created_at"))
+    channel = channel_id or _text(rec.get("channel_id"))
+    guild = guild_id or _text(rec.get("guild_id"))
+    content = rec.get("content") or ""
+    if not author_id or not channel or created_at is None:
+        return None
+
+    message_id = _text(rec.get("id") or rec.get("message_id"))
+    if message_id is None:
+        # Exports without ids (e.g. DiscordChatExporter CSV): derive a stable one.
+        digest = hashlib.sha1(
+            "\x1f".join((channel, author_id, created_at.isoformat(), content)).encode("utf-8")
+        ).hexdigest()
+        message_id = f"csv:{digest}"
+    return (message_id, channel, guild, author_id, author_name, content, is_bot, reference_id, created_at)
+
+
+# ---------- fact batches ----------
+
+class FactBatcher:
+    """Per-author and per-guild text buffers; full batches are handed out."""
+
+    def __init__(self, batch_size: int = 30, max_authors: int = MAX_TRACKED_AUTHORS):
+        self.batch_size = batch_size
+        self.max_authors = max_authors
+        self._users: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._guilds: Dict[str, List[str]] = {}
+        self.ready: List[Tuple[Optional[str], Optional[str], str]] = []
+
+    def add(self, row: Tuple):
+        _, _, guild_id, author_id, _, content, is_bot, _, _ = row
+        content = content.strip()
+        if is_bot or not content:
+            return
+        buf = self._users.setdefault(author_id, [])
+        self._users.move_to_end(author_id)
+        buf.append(content)
+        if len(buf) >= self.batch_size:
+            self.ready.append((author_id, guild_id, "\n".join(buf)))
+            buf.clear()
+        if len(self._users) > self.max_authors:
+            evicted, rest = self._users.popitem(last=False)
+            if rest:
+                self.ready.append((evicted, None, "\n".join(rest)))
+        if guild_id:
+            gbuf = self._guilds.setdefault(guild_id, [])
+            gbuf.append(content)
+            if len(gbuf) >= self.batch_size:
+                self.ready.append((None, guild_id, "\n".join(gbuf)))
+                gbuf.clear()
+
+    def take(self) -> List[Tuple[Optional[str], Optional[str], str]]:
+        out, self.ready = self.ready, []
+        return out
+
+    def flush(self) -> List[Tuple[Optional[str], Optional[str], str]]:
+        """Queue partial buffers too (end of the import)."""
+        for author_id, buf in self._users.items():
+            if buf:
+                self.ready.append((author_id, None, "\n".join(buf)))
+        for guild_id, buf in self._guilds.items():
+            if buf:
+                self.ready.append((None, guild_id, "\n".join(buf)))
+        self._users.clear()
+        self._guilds.clear()
+        return self.take()
+
+
+# ---------- import ----------
+
+def source_key(path: str, channel_id: Optional[str] = None, guild_id: Optional[str] = None) -> str:
+    """
+    Resume key: the same file (path and size) imported with the same
+    --channel-id/--guild-id resumes; a changed file or override restarts.
+    """
+    key = f"{os.path.abspath(path)}:{os.path.getsize(path)}"
+    if channel_id or guild_id:
+        key += f":{channel_id or ''}:{guild_id or ''}"
+    return key
+
+
+def import_file(
+    backend: StorageBackend,
+    path: str,
+    fmt: str = "auto",
+    channel_id: Optional[str] = None,
+    guild_id: Optional[str] = None,
+    batch_size: int = 5000,
+    queue_facts: bool = False,
+) -> Dict[str, int]:
+    fmt = detect_format(path) if fmt == "auto" else fmt
+    source = source_key(path, channel_id, guild_id)
+    done = backend.get_import_progress(source)
+    if done:
+        print(f"{path}: resuming after {done} records")
+
+    header: Dict[str, Any] = {}
+    batcher = FactBatcher() if queue_facts else None
+    stats = {"records": 0, "inserted": 0, "skipped": 0}
+    rows: List[Tuple] = []
+    usable = 0
+    unusable_run = 0
+    start = time.perf_counter()
+
+    def commit(final: bool = False):
+        facts = []
+        if batcher is not None:
+            facts = batcher.flush() if final else batcher.take()
+        if not rows and not facts and not final:
+            return
+        stats["inserted"] += backend.import_batch(rows, source, stats["records"], facts)
+        rows.clear()
+        elapsed = time.perf_counter() - start
+        new = stats["records"] - done
+        print(
+            f"{path}: {stats['records']} records, {stats['inserted']} new, "
+            f"{new / elapsed if elapsed else 0:.0f} records/s",
+            flush=True,
+        )
+
+    with _open(path) as fh:
+        if fmt == "json":
+            records = _iter_json(fh, header)
+        elif fmt == "jsonl":
+            records = _iter_jsonl(fh)
+        else:
+            records = _iter_csv(fh)
+        for rec in records:
+            if not stats["records"]:
+                # The JSON header is read along with the first record.
+                channel = channel_id or _text((header.get("channel") or {}).get("id"))
+                guild = guild_id or _text((header.get("guild") or {}).get("id"))
+                if header and not channel:
+                    raise ValueError(f"{path}: the export header has no channel id; pass --channel-id")
+            stats["records"] += 1
+            if stats["records"] <= done:
+                continue
+            row = normalize(rec, channel, guild)
+            if row is None:
+                stats["skipped"] += 1
+                unusable_run += 1
+                if unusable_run >= batch_size:
+                    raise ValueError(
+                        f"{path}: {unusable_run} records in a row lack an author, channel or timestamp "
+                        f"(record {stats['records']}); check the format and --channel-id/--guild-id"
+                    )
+                continue
+            usable += 1
+            unusable_run = 0
+            rows.append(row)
+            if batcher is not None:
+                batcher.add(row)
+            if len(rows) >= batch_size:
+                commit()
+    if stats["records"] > done:
+        if not usable:
+            raise ValueError(
+                f"{path}: none of {stats['records'] - done} records has an author, channel and timestamp; "
+                f"check the format and --channel-id/--guild-id"
+            )
+        commit(final=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="export files (.json, .jsonl, .csv, optionally .gz)")
+    parser.add_argument("--format", default="auto", choices=["auto", "json", "jsonl", "csv"])
+    parser.add_argument("--channel-id", default=None, help="channel for records that do not carry one")
+    parser.add_argument("--guild-id", default=None, help="guild for records that do not carry one")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per transaction (default: 5000)")
+    parser.add_argument("--queue-facts", action="store_true", help="queue history for background fact extraction")
+    parser.add_argument("--index", action="store_true", help="update the search index before exiting")
+    args = parser.parse_args()
+
+    backend = get_backend()
+    logger.ensure_schema()
+    backend.execute_script(SCHEMA)
+
+    failed = 0
+    for path in args.paths:
+        try:
+            stats = import_file(
+                backend,
+                path,
+                fmt=args.format,
+                channel_id=args.channel_id,
+                guild_id=args.guild_id,
+                batch_size=args.batch_size,
+                queue_facts=args.queue_facts,
+            )
+        except ValueError as exc:
+            print(f"Import failed: {exc}", flush=True)
+            failed += 1
+            continue
+        print(f"{path}: done, {stats['inserted']} new rows, {stats['skipped']} unusable records", flush=True)
+
+    if args.index:
+        total = 0
+        while True:
+            indexed = logger.index_pending_messages(10_000)
+            total += indexed
+            if indexed < 10_000:
+                break
+        print(f"Indexed {total} messages for search.")
+    backend.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# launcher.py
+"""
+Sharded multi-process run mode: splits the bot's shards across N worker
+processes (each one runs main.py with SHARD_COUNT / SHARD_IDS set) and
+restarts workers that exit.
+
+    python launcher.py --workers 4               # shard count from Discord
+    python launcher.py --workers 4 --shards 16
+    python launcher.py --shards 16 --shard-ids 8-15 --workers 2   # second machine
+
+All workers must share one Postgres database: per-thread compaction is
+coordinated through advisory locks (see StorageBackend.try_lock).
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv  # pip install python-dotenv
+
+from app import parse_shard_ids
+
+load_dotenv()  # reads .env in project root
+
+# Discord allows one IDENTIFY per 5s per max_concurrency bucket.
+IDENTIFY_INTERVAL = 5.0
+
+
+def fetch_gateway_info(token: str) -> Dict:
+    """Recommended shard count and session start limits for this bot."""
+    req = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (launcher, 1.0)"},
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def split_shards(shard_ids: List[int], workers: int) -> List[List[int]]:
+    """Contiguous, near-equal shard ranges, one per worker."""
+    workers = max(1, min(workers, len(shard_ids)))
+    size, extra = divmod(len(shard_ids), workers)
+    out, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        out.append(shard_ids[start:end])
+        start = end
+    return out
+
+
+def _format_ids(ids: List[int]) -> str:
+    return ",".join(str(i) for i in ids)
+
+
+class Worker:
+    def __init__(self, index: int, shard_count: int, shard_ids: List[int], metrics_port: Optional[int]):
+        self.index = index
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.metrics_port = metrics_port
+        self.proc: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.next_start = 0.0
+
+    def start(self):
+        env = dict(os.environ, SHARD_COUNT=str(self.shard_count), SHARD_IDS=_format_ids(self.shard_ids))
+        if self.metrics_port is not None:
+            env["METRICS_PORT"] = str(self.metrics_port)
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.proc = subprocess.Popen([sys.executable, os.path.join(here, "main.py")], env=env, cwd=here)
+        print(f"[launcher] worker {self.index} pid={self.proc.pid} shards={_format_ids(self.shard_ids)}", flush=True)
+
+
+def run(workers: List[Worker], stagger: float):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    now = time.monotonic()
+    delay = 0.0
+    for w in workers:
+        w.next_start = now + delay
+        delay += stagger * len(w.shard_ids)
+
+    while not stopping:
+        now = time.monotonic()
+        for w in workers:
+            if w.proc is None:
+                if now >= w.next_start:
+                    w.start()
+                continue
+            code = w.proc.poll()
+            if code is None:
+                continue
+            w.restarts += 1
+            backoff = min(60.0, 2.0 ** min(w.restarts, 6))
+            print(f"[launcher] worker {w.index} exited with {code}; restarting in {backoff:.0f}s", flush=True)
+            w.proc = None
+            w.next_start = now + backoff
+        time.sleep(0.5)
+
+    for w in workers:
+        if w.proc is not None and w.proc.poll() is None:
+            w.proc.terminate()
+    for w in workers:
+        if w.proc is not None:
+            try:
+                w.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                w.proc.kill()
+
+
+def plan(args, token: str) -> Tuple[int, List[int], float]:
+    shard_count = args.shards
+    concurrency = 1
+    if shard_count is None or args.stagger is None:
+        info = fetch_gateway_info(token)
+        shard_count = shard_count or int(info["shards"])
+        concurrency = int(info.get("session_start_limit", {}).get("max_concurrency", 1))
+    shard_ids = parse_shard_ids(args.shard_ids) if args.shard_ids else list(range(shard_count))
+    stagger = args.stagger if args.stagger is not None else IDENTIFY_INTERVAL / concurrency
+    return shard_count, shard_ids, stagger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--shards", type=int, default=None, help="total shard count (default: Discord's recommendation)")
+    parser.add_argument("--shard-ids", default=None, help='shards run by this machine, e.g. "0-7" (default: all)')
+    parser.add_argument("--stagger", type=float, default=None, help="seconds between IDENTIFYs per shard")
+    parser.add_argument(
+        "--metrics-base-port",
+        type=int,
+        default=int(os.environ["METRICS_PORT"]) if os.getenv("METRICS_PORT") else None,
+        help="worker i serves /metrics on base+i (default: METRICS_PORT)",
+    )
+    args = parser.parse_args()
+
+    token = os.getenv("YOUR_BOT_TOKEN")
+    if not token:
+        raise RuntimeError("Missing YOUR_BOT_TOKEN")
+
+    shard_count, shard_ids, stagger = plan(args, token)
+    groups = split_shards(shard_ids, args.workers)
+    if len(groups) > 1 and os.getenv("STORAGE_BACKEND", "postgres").lower() != "postgres":
+        raise RuntimeError("Multiple workers need STORAGE_BACKEND=postgres for cross-process locking.")
+    workers = [
+        Worker(
+            i,
+            shard_count,
+            ids,
+            args.metrics_base_port + i if args.metrics_base_port is not None else None,
+        )
+        for i, ids in enumerate(groups)
+    ]
+    print(f"[launcher] {shard_count} shards, running {_format_ids(shard_ids)} on {len(workers)} workers", flush=True)
+    run(workers, stagger)
+
+
+if __name__ == "__main__":
+    main()
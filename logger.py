@@ -1,28 +1,32 @@
 # logger.py
+import re
+import weakref
 import discord
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
-from db_postgres import get_connection
+from storage import get_backend
+
+# Backends whose messages schema has already been created this process.
+_schema_ready: "weakref.WeakSet" = weakref.WeakSet()
 
 
 def fetch_user_recent_in_channel(channel_id: int, user_id: int, minutes=240, limit=40):
     cutoff = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT author_id, author_name, content, is_bot, created_at
-                FROM messages
-                WHERE channel_id = %s
-                  AND author_id = %s
-                  AND created_at >= %s
-                ORDER BY created_at ASC
-                LIMIT %s
-                """,
-                (str(channel_id), str(user_id), cutoff, limit),
-            )
-            rows = cur.fetchall()
+    with get_backend().cursor() as cur:
+        cur.execute(
+            """
+            SELECT author_id, author_name, content, is_bot, created_at
+            FROM messages
+            WHERE channel_id = %s
+              AND author_id = %s
+              AND created_at >= %s
+            ORDER BY created_at ASC
+            LIMIT %s
+            """,
+            (str(channel_id), str(user_id), cutoff, limit),
+        )
+        rows = cur.fetchall()
 
     lines = []
     for r in rows:
@@ -36,21 +40,20 @@ def fetch_user_recent_in_channel(channel_id: int, user_id: int, minutes=240, lim
 def fetch_user_recent_in_guild(guild_id: int, user_id: int, minutes=240, limit=80):
     """Fallback if nothing in this channel; look across the whole server."""
     cutoff = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT channel_id, author_id, author_name, content, created_at
-                FROM messages
-                WHERE guild_id = %s
-                  AND author_id = %s
-                  AND created_at >= %s
-                ORDER BY created_at ASC
-                LIMIT %s
-                """,
-                (str(guild_id), str(user_id), cutoff, limit),
-            )
-            rows = cur.fetchall()
+    with get_backend().cursor() as cur:
+        cur.execute(
+            """
+            SELECT channel_id, author_id, author_name, content, created_at
+            FROM messages
+            WHERE guild_id = %s
+              AND author_id = %s
+              AND created_at >= %s
+            ORDER BY created_at ASC
+            LIMIT %s
+            """,
+            (str(guild_id), str(user_id), cutoff, limit),
+        )
+        rows = cur.fetchall()
 
     lines = []
     for r in rows:
@@ -62,27 +65,31 @@ def fetch_user_recent_in_guild(guild_id: int, user_id: int, minutes=240, limit=8
 
 
 def ensure_schema():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id           BIGSERIAL PRIMARY KEY,
-                    message_id   TEXT NOT NULL,
-                    channel_id   TEXT NOT NULL,
-                    guild_id     TEXT,
-                    author_id    TEXT NOT NULL,
-                    author_name  TEXT,
-                    content      TEXT,
-                    is_bot       BOOLEAN NOT NULL DEFAULT FALSE,
-                    reference_id TEXT,
-                    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                )
-                """
+    backend = get_backend()
+    if backend in _schema_ready:
+        return
+    with backend.cursor(write=True) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id           BIGSERIAL PRIMARY KEY,
+                message_id   TEXT NOT NULL,
+                channel_id   TEXT NOT NULL,
+                guild_id     TEXT,
+                author_id    TEXT NOT NULL,
+                author_name  TEXT,
+                content      TEXT,
+                is_bot       BOOLEAN NOT NULL DEFAULT FALSE,
+                reference_id TEXT,
+                created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
             )
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_channel_time ON messages(channel_id, created_at)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_message_id ON messages(message_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_reference_id ON messages(reference_id)")
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_channel_time ON messages(channel_id, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_message_id ON messages(message_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_reference_id ON messages(reference_id)")
+    backend.ensure_search_schema()
+    _schema_ready.add(backend)
 
 
 def _utcnow():
@@ -104,14 +111,13 @@ def log_message(msg: discord.Message):
     if msg.reference and msg.reference.message_id:
         ref_id = str(msg.reference.message_id)
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """INSERT INTO messages
-                   (message_id, channel_id, guild_id, author_id, author_name, content, is_bot, reference_id, created_at)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                (str(msg.id), channel_id, guild_id, author_id, author_name, content, is_bot, ref_id, _utcnow()),
-            )
+    with get_backend().cursor(write=True) as cur:
+        cur.execute(
+            """INSERT INTO messages
+               (message_id, channel_id, guild_id, author_id, author_name, content, is_bot, reference_id, created_at)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            (str(msg.id), channel_id, guild_id, author_id, author_name, content, is_bot, ref_id, _utcnow()),
+        )
 
 
 def fetch_recent_history_for_scope(message: discord.Message, limit=40, minutes=90):
@@ -134,10 +140,9 @@ def fetch_recent_history_for_scope(message: discord.Message, limit=40, minutes=9
     """
     params = (channel_id, cutoff_dt, limit)
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, params)
-            rows = cur.fetchall()
+    with get_backend().cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
 
     lines = []
     for r in rows:
@@ -147,3 +152,64 @@ def fetch_recent_history_for_scope(message: discord.Message, limit=40, minutes=9
         name = r["author_name"] or r["author_id"]
         lines.append(f"{role}({name}): {r['content']}")
     return lines
+
+
+# ---------- keyword search over older history ----------
+
+_MENTION_RE = re.compile(r"<[@#][!&]?\d+>|<a?:\w+:\d+>|https?://\S+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = frozenset(
+    """
+    the and for are but not you your yours with this that these those from have has had was were what when
+    where which who whom why how about into over under again then than them they their there here our ours
+    can could would should will shall did does doing done any all some just also very too more most such
+    only own same out off once been being its itself him his her hers she he we us my mine me i a an
+    of on in to at by or as is be do if so no up down week last ago yesterday today tell said say decide
+    decided discuss discussed remember anyone someone something
+    """.split()
+)
+
+
+def search_terms(text: str, max_terms: int = 8) -> list[str]:
+    """Keywords worth searching for: no mentions/URLs, stopwords or short tokens."""
+    cleaned = _MENTION_RE.sub(" ", text or "").lower()
+    terms: list[str] = []
+    for word in _WORD_RE.findall(cleaned):
+        if len(word) < 3 or word in _STOPWORDS or word.isdigit() or word in terms:
+            continue
+        terms.append(word)
+        if len(terms) >= max_terms:
+            break
+    return terms
+
+
+def index_pending_messages(batch_size=2000) -> int:
+    """Add up to batch_size unindexed messages to the search index."""
+    ensure_schema()
+    return get_backend().index_pending_messages(batch_size)
+
+
+def fetch_relevant_history(message: discord.Message, query: Optional[str] = None, limit=15, exclude_minutes=240):
+    """
+    Best-matching older messages in this channel/thread for the query's
+    keywords (defaults to the message text). Messages newer than
+    exclude_minutes are skipped because the ambient window already has them.
+    Oldest -> newest order.
+    """
+    terms = search_terms(message.content if query is None else query)
+    if not terms:
+        return []
+    ensure_schema()
+    before = datetime.now(timezone.utc) - timedelta(minutes=exclude_minutes)
+    rows = get_backend().search_messages(str(message.channel.id), terms, before, limit)
+    rows.sort(key=lambda r: str(r["created_at"]))
+
+    lines = []
+    for r in rows:
+        if not r["content"]:
+            continue
+        role = "assistant" if r["is_bot"] else "user"
+        name = r["author_name"] or r["author_id"]
+        when = str(r["created_at"])[:10]
+        lines.append(f"[{when}] {role}({name}): {r['content']}")
+    return lines
@@ -1,3 +1,4 @@
+from app import check_config
 from bot import bot
 
 from dotenv import load_dotenv  # pip install python-dotenv
@@ -10,4 +11,5 @@ if not YOUR_BOT_TOKEN:
     raise RuntimeError("Missing YOUR_BOT_TOKEN")
 
 if __name__ == "__main__":
+    check_config()
     bot.run(YOUR_BOT_TOKEN)
\ No newline at end of file
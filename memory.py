@@ -5,23 +5,36 @@ import threading
 import json
 from typing import Dict, Any, List
 
-from google import genai
-
-from db_postgres import get_connection
+import metrics
+from storage import StorageBackend, get_backend
 
 load_dotenv()  # reads .env in project root
 
-YOUR_API_KEY = os.getenv("YOUR_API_KEY")
-if not YOUR_API_KEY:
-    raise RuntimeError("Missing MY_API_KEY")
-
-client = genai.Client(api_key=YOUR_API_KEY)
 MODEL = "gemini-2.5-flash"
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Gemini client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("YOUR_API_KEY")
+                if not api_key:
+                    raise RuntimeError("Missing Gemini API key. Set YOUR_API_KEY.")
+                from google import genai
+
+                _client = genai.Client(api_key=api_key)
+    return _client
+
 
 class Memory:
-    def __init__(self, max_chars: int = 6000):
+    def __init__(self, max_chars: int = 6000, backend: StorageBackend | None = None):
         self.max_chars = max_chars
+        self.backend = backend or get_backend()
         self._lock = threading.RLock()
         self._user_fact_buffers: Dict[str, List[str]] = {}
         self._guild_fact_buffers: Dict[str, List[str]] = {}
@@ -65,11 +78,17 @@ class Memory:
             )
             """,
             "CREATE INDEX IF NOT EXISTS team_facts_guild_idx ON team_facts(guild_id, ts DESC)",
+            """
+            CREATE TABLE IF NOT EXISTS fact_queue (
+                id       BIGSERIAL PRIMARY KEY,
+                user_id  TEXT,
+                guild_id TEXT,
+                text     TEXT NOT NULL,
+                ts       DOUBLE PRECISION NOT NULL
+            )
+            """,
         ]
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for stmt in statements:
-                    cur.execute(stmt)
+        self.backend.execute_script(statements)
 
     # ---------- keying strategy ----------
     def _key(self, message) -> str:
@@ -78,20 +97,19 @@ class Memory:
 
     # ---------- thread ops ----------
     def get_thread(self, key: str) -> Dict[str, Any]:
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT summary FROM threads WHERE thread_key=%s",
-                    (key,),
-                )
-                row = cur.fetchone()
-                summary = row["summary"] if row else ""
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                "SELECT summary FROM threads WHERE thread_key=%s",
+                (key,),
+            )
+            row = cur.fetchone()
+            summary = row["summary"] if row else ""
 
-                cur.execute(
-                    "SELECT role, text, ts FROM turns WHERE thread_key=%s ORDER BY id ASC",
-                    (key,),
-                )
-                turns = cur.fetchall()
+            cur.execute(
+                "SELECT role, text, ts FROM turns WHERE thread_key=%s ORDER BY id ASC",
+                (key,),
+            )
+            turns = cur.fetchall()
 
         return {
             "summary": summary,
@@ -99,47 +117,45 @@ class Memory:
         }
 
     def save_thread(self, key: str, thread: Dict[str, Any]):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO threads(thread_key, summary) VALUES(%s, %s)
-                    ON CONFLICT(thread_key) DO UPDATE SET summary=EXCLUDED.summary
-                    """,
-                    (key, thread.get("summary", "")),
-                )
+        with self._lock, self.backend.cursor(write=True) as cur:
+            cur.execute(
+                """
+                INSERT INTO threads(thread_key, summary) VALUES(%s, %s)
+                ON CONFLICT(thread_key) DO UPDATE SET summary=EXCLUDED.summary
+                """,
+                (key, thread.get("summary", "")),
+            )
 
     def add_turn(self, key: str, role: str, text: str):
         now = time.time()
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO threads(thread_key, summary) VALUES(%s, '')
-                    ON CONFLICT(thread_key) DO NOTHING
-                    """,
-                    (key,),
-                )
-                cur.execute(
-                    "INSERT INTO turns(thread_key, role, text, ts) VALUES(%s, %s, %s, %s)",
-                    (key, role, text, now),
-                )
-        self._trim_or_summarize(key)
+        with self._lock, self.backend.cursor(write=True) as cur:
+            cur.execute(
+                """
+                INSERT INTO threads(thread_key, summary) VALUES(%s, '')
+                ON CONFLICT(thread_key) DO NOTHING
+                """,
+                (key,),
+            )
+            cur.execute(
+                "INSERT INTO turns(thread_key, role, text, ts) VALUES(%s, %s, %s, %s)",
+                (key, role, text, now),
+            )
+        with metrics.span("trim_or_summarize"):
+            self._trim_or_summarize(key)
 
     def _length_stats(self, key: str):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT COALESCE(summary, '') AS summary FROM threads WHERE thread_key=%s",
-                    (key,),
-                )
-                srow = cur.fetchone()
-                summary = srow["summary"] if srow else ""
-                cur.execute(
-                    "SELECT id, text FROM turns WHERE thread_key=%s ORDER BY id ASC",
-                    (key,),
-                )
-                trows = cur.fetchall()
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                "SELECT COALESCE(summary, '') AS summary FROM threads WHERE thread_key=%s",
+                (key,),
+            )
+            srow = cur.fetchone()
+            summary = srow["summary"] if srow else ""
+            cur.execute(
+                "SELECT id, text FROM turns WHERE thread_key=%s ORDER BY id ASC",
+                (key,),
+            )
+            trows = cur.fetchall()
         total_turn_chars = sum(len(r["text"]) for r in trows)
         return summary, trows, len(summary) + total_turn_chars
 
@@ -148,35 +164,43 @@ class Memory:
         if total <= self.max_chars:
             return
 
+        # One compactor per thread across all workers; the others skip this round.
+        with self.backend.try_lock(f"compact:{key}") as acquired:
+            if not acquired:
+                return
+            summary, trows, total = self._length_stats(key)
+            if total <= self.max_chars:
+                return
+            self._compact(key, summary, trows)
+
+    def _compact(self, key: str, summary: str, trows: List[Dict[str, Any]]):
         if len(trows) > 6:
             cut = max(4, int(len(trows) * 0.7))
             older_ids = [r["id"] for r in trows[:cut]]
 
             placeholders = ",".join(["%s"] * len(older_ids))
             convo_text = ""
-            with self._lock, get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        f"SELECT role, text FROM turns WHERE id IN ({placeholders}) ORDER BY id ASC",
-                        older_ids,
-                    )
-                    older = cur.fetchall()
+            with self._lock, self.backend.cursor() as cur:
+                cur.execute(
+                    f"SELECT role, text FROM turns WHERE id IN ({placeholders}) ORDER BY id ASC",
+                    older_ids,
+                )
+                older = cur.fetchall()
             if older:
                 convo_text = "\n".join(f"{r['role'].capitalize()}: {r['text']}" for r in older)
 
             summary_add = summarize(convo_text, limit=800) if convo_text else ""
 
-            with self._lock, get_connection() as conn:
-                with conn.cursor() as cur:
-                    new_summary = (summary + "\n" + summary_add).strip() if summary else summary_add
-                    cur.execute(
-                        "UPDATE threads SET summary=%s WHERE thread_key=%s",
-                        (new_summary, key),
-                    )
-                    cur.execute(
-                        f"DELETE FROM turns WHERE id IN ({placeholders})",
-                        older_ids,
-                    )
+            with self._lock, self.backend.cursor(write=True) as cur:
+                new_summary = (summary + "\n" + summary_add).strip() if summary else summary_add
+                cur.execute(
+                    "UPDATE threads SET summary=%s WHERE thread_key=%s",
+                    (new_summary, key),
+                )
+                cur.execute(
+                    f"DELETE FROM turns WHERE id IN ({placeholders})",
+                    older_ids,
+                )
 
             summary2, trows2, total2 = self._length_stats(key)
             if total2 > self.max_chars and len(trows2) > 6:
@@ -184,89 +208,83 @@ class Memory:
                 to_del = [r["id"] for r in trows2 if r["id"] not in to_keep]
                 if to_del:
                     placeholders = ",".join(["%s"] * len(to_del))
-                    with self._lock, get_connection() as conn:
-                        with conn.cursor() as cur:
-                            cur.execute(
-                                f"DELETE FROM turns WHERE id IN ({placeholders})",
-                                to_del,
-                            )
+                    with self._lock, self.backend.cursor(write=True) as cur:
+                        cur.execute(
+                            f"DELETE FROM turns WHERE id IN ({placeholders})",
+                            to_del,
+                        )
         else:
             to_keep = {r["id"] for r in trows[-6:]}
             to_del = [r["id"] for r in trows if r["id"] not in to_keep]
             if to_del:
                 placeholders = ",".join(["%s"] * len(to_del))
-                with self._lock, get_connection() as conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            f"DELETE FROM turns WHERE id IN ({placeholders})",
-                            to_del,
-                        )
+                with self._lock, self.backend.cursor(write=True) as cur:
+                    cur.execute(
+                        f"DELETE FROM turns WHERE id IN ({placeholders})",
+                        to_del,
+                    )
 
     # ---------- long-term facts ----------
     def add_fact(self, user_id: int, fact: str, cap: int = 100):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO profiles(user_id, fact, ts) VALUES(%s, %s, %s)",
-                    (str(user_id), fact.strip(), time.time()),
-                )
+        with self._lock, self.backend.cursor(write=True) as cur:
+            cur.execute(
+                "INSERT INTO profiles(user_id, fact, ts) VALUES(%s, %s, %s)",
+                (str(user_id), fact.strip(), time.time()),
+            )
+            cur.execute(
+                "SELECT id FROM profiles WHERE user_id=%s ORDER BY ts DESC",
+                (str(user_id),),
+            )
+            rows = cur.fetchall()
+            if len(rows) > cap:
+                to_delete = [r["id"] for r in rows[cap:]]
+                placeholders = ",".join(["%s"] * len(to_delete))
                 cur.execute(
-                    "SELECT id FROM profiles WHERE user_id=%s ORDER BY ts DESC",
-                    (str(user_id),),
+                    f"DELETE FROM profiles WHERE id IN ({placeholders})",
+                    to_delete,
                 )
-                rows = cur.fetchall()
-                if len(rows) > cap:
-                    to_delete = [r["id"] for r in rows[cap:]]
-                    placeholders = ",".join(["%s"] * len(to_delete))
-                    cur.execute(
-                        f"DELETE FROM profiles WHERE id IN ({placeholders})",
-                        to_delete,
-                    )
 
     def get_facts(self, user_id: int) -> List[str]:
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT fact FROM profiles WHERE user_id=%s ORDER BY ts DESC",
-                    (str(user_id),),
-                )
-                rows = cur.fetchall()
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                "SELECT fact FROM profiles WHERE user_id=%s ORDER BY ts DESC",
+                (str(user_id),),
+            )
+            rows = cur.fetchall()
         return [r["fact"] for r in rows]
 
     def add_team_fact(self, guild_id: int, fact: str, cap: int = 300):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO team_facts(guild_id, fact, ts) VALUES(%s, %s, %s)",
-                    (str(guild_id), fact.strip(), time.time()),
-                )
+        with self._lock, self.backend.cursor(write=True) as cur:
+            cur.execute(
+                "INSERT INTO team_facts(guild_id, fact, ts) VALUES(%s, %s, %s)",
+                (str(guild_id), fact.strip(), time.time()),
+            )
+            cur.execute(
+                "SELECT id FROM team_facts WHERE guild_id=%s ORDER BY ts DESC",
+                (str(guild_id),),
+            )
+            rows = cur.fetchall()
+            if len(rows) > cap:
+                to_delete = [r["id"] for r in rows[cap:]]
+                placeholders = ",".join(["%s"] * len(to_delete))
                 cur.execute(
-                    "SELECT id FROM team_facts WHERE guild_id=%s ORDER BY ts DESC",
-                    (str(guild_id),),
+                    f"DELETE FROM team_facts WHERE id IN ({placeholders})",
+                    to_delete,
                 )
-                rows = cur.fetchall()
-                if len(rows) > cap:
-                    to_delete = [r["id"] for r in rows[cap:]]
-                    placeholders = ",".join(["%s"] * len(to_delete))
-                    cur.execute(
-                        f"DELETE FROM team_facts WHERE id IN ({placeholders})",
-                        to_delete,
-                    )
 
     def get_team_facts(self, guild_id: int, limit: int = 50) -> List[str]:
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT fact
-                    FROM team_facts
-                    WHERE guild_id=%s
-                    ORDER BY ts DESC
-                    LIMIT %s
-                    """,
-                    (str(guild_id), limit),
-                )
-                rows = cur.fetchall()
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                """
+                SELECT fact
+                FROM team_facts
+                WHERE guild_id=%s
+                ORDER BY ts DESC
+                LIMIT %s
+                """,
+                (str(guild_id), limit),
+            )
+            rows = cur.fetchall()
         return [r["fact"] for r in rows]
 
     # ---------- auto-fact extraction ----------
@@ -284,71 +302,134 @@ class Memory:
             elif fact_type == "user":
                 self._add_fact_unique(user_id, fact_text)
 
-    def record_message_for_facts(self, user_id: int, guild_id: int | None, text: str, batch_size: int = 30):
+    def record_message_for_facts(
+        self,
+        user_id: int,
+        guild_id: int | None,
+        text: str,
+        batch_size: int = 30,
+        defer: bool = False,
+    ):
+        """
+        Buffer messages per user and per guild and extract facts once a batch
+        fills. Buffers are process-local: under sharding each guild lives on
+        exactly one worker, so guild batches never split; a user active on
+        several shards gets one batch per worker.
+
+        With ``defer=True`` (the bot is overloaded) a full batch goes to
+        ``fact_queue`` instead, and the background drain extracts it once
+        load drops.
+        """
         cleaned = (text or "").strip()
         if not cleaned:
             return
 
-        user_key = str(user_id)
-        user_buf = self._user_fact_buffers.setdefault(user_key, [])
-        user_buf.append(cleaned)
-        if len(user_buf) >= batch_size:
-            batch_text = "\n".join(user_buf[-batch_size:])
-            facts = extract_facts(batch_text)
-            for item in facts:
-                if item.get("type") == "user":
-                    fact_text = (item.get("fact") or "").strip()
-                    if fact_text:
-                        self._add_fact_unique(user_id, fact_text)
-            self._user_fact_buffers[user_key] = []
-
-        if guild_id is None:
-            return
-        guild_key = str(guild_id)
-        guild_buf = self._guild_fact_buffers.setdefault(guild_key, [])
-        guild_buf.append(cleaned)
-        if len(guild_buf) >= batch_size:
-            batch_text = "\n".join(guild_buf[-batch_size:])
-            facts = extract_facts(batch_text)
-            for item in facts:
-                if item.get("type") == "team":
-                    fact_text = (item.get("fact") or "").strip()
-                    if fact_text:
-                        self._add_team_fact_unique(guild_id, fact_text)
-            self._guild_fact_buffers[guild_key] = []
+        batches = []
+        with self._lock:
+            user_buf = self._user_fact_buffers.setdefault(str(user_id), [])
+            user_buf.append(cleaned)
+            if len(user_buf) >= batch_size:
+                batches.append((user_id, None, "\n".join(user_buf)))
+                user_buf.clear()
+            if guild_id is not None:
+                guild_buf = self._guild_fact_buffers.setdefault(str(guild_id), [])
+                guild_buf.append(cleaned)
+                if len(guild_buf) >= batch_size:
+                    batches.append((None, guild_id, "\n".join(guild_buf)))
+                    guild_buf.clear()
+        for batch_user, batch_guild, batch_text in batches:
+            if defer:
+                self.queue_fact_batch(batch_user, batch_guild, batch_text)
+            else:
+                self._apply_batch_facts(batch_user, batch_guild, batch_text)
+        self._report_buffer_depth()
+
+    def queue_fact_batch(self, user_id: int | None, guild_id: int | None, text: str):
+        """Leave a batch for drain_fact_queue."""
+        with self.backend.cursor(write=True) as cur:
+            cur.execute(
+                "INSERT INTO fact_queue(user_id, guild_id, text, ts) VALUES (%s, %s, %s, %s)",
+                (
+                    str(user_id) if user_id is not None else None,
+                    str(guild_id) if guild_id is not None else None,
+                    text,
+                    time.time(),
+                ),
+            )
+
+    def _apply_batch_facts(self, user_id, guild_id, text: str):
+        """A batch with a user_id yields user facts; one with only a guild_id, team facts."""
+        for item in extract_facts(text):
+            fact_text = (item.get("fact") or "").strip()
+            if not fact_text:
+                continue
+            if user_id and item.get("type") == "user":
+                self._add_fact_unique(user_id, fact_text)
+            elif not user_id and guild_id and item.get("type") == "team":
+                self._add_team_fact_unique(guild_id, fact_text)
+
+    def drain_fact_queue(self, limit: int = 5) -> int:
+        """
+        Extract facts from up to ``limit`` queued batches (from the bulk
+        importer or deferred under load). Returns batches processed. If
+        extraction fails, the failed batch and the rest of the claim go back
+        on the queue before the error is raised.
+        """
+        batches = self.backend.claim_fact_batches(limit)
+        for i, batch in enumerate(batches):
+            try:
+                self._apply_batch_facts(batch["user_id"], batch["guild_id"], batch["text"])
+            except BaseException:
+                self.backend.requeue_fact_batches(batches[i:])
+                raise
+        return len(batches)
+
+    def _report_buffer_depth(self):
+        metrics.set_queue_depth("user_fact_buffer", sum(len(b) for b in self._user_fact_buffers.values()))
+        metrics.set_queue_depth("guild_fact_buffer", sum(len(b) for b in self._guild_fact_buffers.values()))
 
     def _add_fact_unique(self, user_id: int, fact: str, cap: int = 100):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM profiles WHERE user_id=%s AND fact=%s LIMIT 1",
-                    (str(user_id), fact),
-                )
-                if cur.fetchone():
-                    return
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                "SELECT 1 FROM profiles WHERE user_id=%s AND fact=%s LIMIT 1",
+                (str(user_id), fact),
+            )
+            if cur.fetchone():
+                return
         self.add_fact(user_id, fact, cap=cap)
 
     def _add_team_fact_unique(self, guild_id: int, fact: str, cap: int = 300):
-        with self._lock, get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM team_facts WHERE guild_id=%s AND fact=%s LIMIT 1",
-                    (str(guild_id), fact),
-                )
-                if cur.fetchone():
-                    return
+        with self._lock, self.backend.cursor() as cur:
+            cur.execute(
+                "SELECT 1 FROM team_facts WHERE guild_id=%s AND fact=%s LIMIT 1",
+                (str(guild_id), fact),
+            )
+            if cur.fetchone():
+                return
         self.add_team_fact(guild_id, fact, cap=cap)
 
 
+def _record_usage(usage: dict, resp):
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is not None:
+        usage["input"] = getattr(meta, "prompt_token_count", 0) or 0
+        usage["output"] = getattr(meta, "candidates_token_count", 0) or 0
+
+
 def summarize(text: str, limit=800):
-    resp = client.models.generate_content(
-        model=MODEL,
-        contents=(
-            "Summarize the following conversation into factual, compact notes "
-            f"(<= {limit} characters). Keep user goals/preferences and unresolved tasks.\n\n"
-            f"{text}"
-        ),
+    prompt = (
+        "Summarize the following conversation into factual, compact notes "
+        f"(<= {limit} characters). Keep user goals/preferences and unresolved tasks.\n\n"
+        f"{text}"
     )
+    with metrics.llm_call("gemini", "summarize") as usage:
+        usage["prompt"] = prompt
+        resp = get_client().models.generate_content(
+            model=MODEL,
+            contents=prompt,
+        )
+        _record_usage(usage, resp)
+        usage["response"] = resp.text
     return (resp.text or "")[:limit]
 
 
@@ -362,10 +443,14 @@ def extract_facts(text: str) -> List[dict]:
         "Prefer short sentences. If no facts, return [].\n\n"
         f"Text:\n{text}\n"
     )
-    resp = client.models.generate_content(
-        model=MODEL,
-        contents=prompt,
-    )
+    with metrics.llm_call("gemini", "extract_facts") as usage:
+        usage["prompt"] = prompt
+        resp = get_client().models.generate_content(
+            model=MODEL,
+            contents=prompt,
+        )
+        _record_usage(usage, resp)
+        usage["response"] = resp.text
     raw = (resp.text or "").strip()
     if not raw:
         return []
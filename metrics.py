@@ -0,0 +1,298 @@
+# metrics.py
+"""
+In-process instrumentation: timing spans, DB query stats, LLM usage and
+queue depths. Exported as Prometheus text on a local HTTP endpoint and,
+optionally, as one structured JSON log line per handled request.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import capture
+
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "").lower() in ("1", "true", "yes")
+
+# USD per 1M tokens, per provider; override through the environment.
+LLM_PRICES: Dict[str, Tuple[float, float]] = {
+    "openai": (
+        float(os.getenv("OPENAI_COST_PER_1M_INPUT", "0") or 0),
+        float(os.getenv("OPENAI_COST_PER_1M_OUTPUT", "0") or 0),
+    ),
+    "gemini": (
+        float(os.getenv("GEMINI_COST_PER_1M_INPUT", "0") or 0),
+        float(os.getenv("GEMINI_COST_PER_1M_OUTPUT", "0") or 0),
+    ),
+}
+
+# Latency buckets in seconds, shared by every histogram.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        key = _labels(**labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def set(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(**labels)] = value
+            if help:
+                self._help.setdefault(name, help)
+
+    def add(self, name: str, delta: float, help: str = "", **labels):
+        key = _labels(**labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + delta
+            if help:
+                self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = _labels(**labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram()
+            hist.observe(value)
+            if help:
+                self._help.setdefault(name, help)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        out: List[str] = []
+
+        def fmt(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+            items = list(labels) + ([extra] if extra else [])
+            if not items:
+                return ""
+            inner = ",".join(
+                '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items
+            )
+            return "{" + inner + "}"
+
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(store):
+                    if name in self._help:
+                        out.append(f"# HELP {name} {self._help[name]}")
+                    out.append(f"# TYPE {name} {kind}")
+                    for labels, value in store[name].items():
+                        out.append(f"{name}{fmt(labels)} {value}")
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    out.append(f"# HELP {name} {self._help[name]}")
+                out.append(f"# TYPE {name} histogram")
+                for labels, hist in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, hist.counts):
+                        cumulative += n
+                        out.append(f"{name}_bucket{fmt(labels, ('le', str(bound)))} {cumulative}")
+                    out.append(f"{name}_bucket{fmt(labels, ('le', '+Inf'))} {hist.count}")
+                    out.append(f"{name}_sum{fmt(labels)} {hist.total}")
+                    out.append(f"{name}_count{fmt(labels)} {hist.count}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+# ---------- per-request context (for JSON logs) ----------
+
+class RequestTrace:
+    def __init__(self, kind: str, **fields):
+        self.kind = kind
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.llm_calls: List[dict] = []
+
+    def as_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            **self.fields,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans_ms": {k: round(v * 1000, 3) for k, v in self.spans.items()},
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db_seconds * 1000, 3),
+            "llm": self.llm_calls,
+        }
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("metrics_request", default=None)
+
+
+@contextmanager
+def request(kind: str, **fields):
+    """Scope one handled event; emits a JSON log line on exit when enabled."""
+    trace = RequestTrace(kind, **fields)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        registry.observe(
+            "agent_request_seconds",
+            time.perf_counter() - trace.started,
+            help="End-to-end handling time per event.",
+            kind=kind,
+        )
+        if METRICS_JSON_LOGS:
+            print(json.dumps(trace.as_dict(), default=str), flush=True)
+
+
+@contextmanager
+def span(name: str):
+    """Time one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("agent_stage_seconds", elapsed, help="Time spent per pipeline stage.", stage=name)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans[name] = trace.spans.get(name, 0.0) + elapsed
+
+
+def observe_query(sql: str, elapsed: float, ok: bool = True):
+    verb = (sql.lstrip().split(None, 1) or ["?"])[0].upper()
+    registry.inc("agent_db_queries_total", help="Database statements executed.", verb=verb, ok=str(ok).lower())
+    registry.observe("agent_db_query_seconds", elapsed, help="Database statement latency.", verb=verb)
+    trace = _current.get()
+    if trace is not None:
+        trace.db_queries += 1
+        trace.db_seconds += elapsed
+    capture.record_query(sql, elapsed, ok)
+
+
+def observe_llm(
+    provider: str,
+    task: str,
+    elapsed: float,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    ok: bool = True,
+):
+    in_price, out_price = LLM_PRICES.get(provider, (0.0, 0.0))
+    cost = (input_tokens * in_price + output_tokens * out_price) / 1_000_000
+    registry.inc("agent_llm_requests_total", help="LLM calls.", provider=provider, task=task, ok=str(ok).lower())
+    registry.observe("agent_llm_seconds", elapsed, help="LLM call latency.", provider=provider, task=task)
+    registry.inc("agent_llm_tokens_total", input_tokens, help="LLM tokens.", provider=provider, task=task, direction="input")
+    registry.inc("agent_llm_tokens_total", output_tokens, provider=provider, task=task, direction="output")
+    registry.inc("agent_llm_cost_usd_total", cost, help="Estimated LLM spend.", provider=provider, task=task)
+    trace = _current.get()
+    if trace is not None:
+        trace.llm_calls.append({
+            "provider": provider,
+            "task": task,
+            "ms": round(elapsed * 1000, 3),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "ok": ok,
+        })
+
+
+@contextmanager
+def llm_call(provider: str, task: str):
+    """
+    Time an LLM call. The body sets ``usage["input"]``/``usage["output"]``
+    once the response is available, and ``usage["prompt"]``/``usage["response"]``
+    for traffic capture.
+    """
+    usage = {"input": 0, "output": 0}
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield usage
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_llm(provider, task, elapsed, usage["input"], usage["output"], ok)
+        capture.record_llm(provider, task, elapsed, usage, ok)
+
+
+def set_queue_depth(queue: str, depth: int):
+    registry.set("agent_queue_depth", depth, help="Items waiting per internal queue.", queue=queue)
+
+
+def add_inflight(name: str, delta: int):
+    registry.add("agent_inflight", delta, help="Requests currently being processed.", stage=name)
+
+
+# ---------- HTTP exporter ----------
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_http_server(port: Optional[int] = None, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a daemon thread. No-op unless a port is configured."""
+    global _server
+    if _server is not None:
+        return _server
+    if port is None:
+        if not METRICS_PORT:
+            return None
+        port = int(METRICS_PORT)
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
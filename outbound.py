@@ -0,0 +1,327 @@
+# outbound.py
+"""
+Outbound message delivery: per-channel queues, token-bucket pacing, fence-
+aware chunking and retry with jitter.
+
+Handlers call ``outbox.enqueue(channel, text)`` and return immediately; one
+worker task per active channel sends the chunks in order.
+
+discord.py already honours rate-limit headers inside its HTTP client, but it
+does so by sleeping inside the awaiting handler. The buckets here pace sends
+to Discord's documented limits (5 messages / 5 s per channel, 50 requests / s
+globally) so we rarely reach that path, and when a 429 does surface the
+Retry-After / X-RateLimit-Reset-After headers drain the matching bucket.
+"""
+import asyncio
+import random
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import discord
+
+import metrics
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+
+# ---------- chunking ----------
+
+def _blocks(text: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Split text into paragraphs and fenced code blocks. Each item is
+    (block_text, fence_opening_line or None).
+    """
+    blocks: List[Tuple[str, Optional[str]]] = []
+    buf: List[str] = []
+    fence: Optional[str] = None
+    marker = ""
+    for line in text.splitlines(keepends=True):
+        match = _FENCE_RE.match(line)
+        if fence is None:
+            if match and line.count(match.group(1)) == 1:
+                if buf:
+                    blocks.append(("".join(buf), None))
+                buf = [line]
+                fence = line.rstrip("\r\n")
+                marker = match.group(1)
+                continue
+            buf.append(line)
+            if not line.strip():
+                blocks.append(("".join(buf), None))
+                buf = []
+        else:
+            buf.append(line)
+            if marker in line:
+                blocks.append(("".join(buf), fence))
+                buf = []
+                fence = None
+    if buf:
+        blocks.append(("".join(buf), fence))
+    return blocks
+
+
+def _hard_split(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _split_text(block: str, limit: int) -> List[str]:
+    """Break prose at whitespace, falling back to a hard cut for huge words."""
+    pieces: List[str] = []
+    cur = ""
+    for token in re.split(r"(\s+)", block):
+        if not token:
+            continue
+        if len(cur) + len(token) <= limit:
+            cur += token
+            continue
+        if cur:
+            pieces.append(cur)
+        cur = ""
+        if len(token) > limit:
+            *full, token = _hard_split(token, limit)
+            pieces.extend(full)
+        cur = token
+    pieces.append(cur)
+    return pieces
+
+
+def _split_code(block: str, fence: str, limit: int) -> List[str]:
+    """Break an oversized code block by lines, closing and reopening the fence."""
+    marker = _FENCE_RE.match(fence).group(1)
+    opener = fence + "\n"
+    closer = marker
+    room = limit - len(opener) - len(closer) - 1
+    pieces: List[str] = []
+    cur = ""
+    for line in block.splitlines(keepends=True):
+        segments = _hard_split(line, room) if len(line) > room else [line]
+        for seg in segments:
+            if cur and len(cur) + len(seg) + len(closer) + 1 > limit:
+                pieces.append(cur + ("" if cur.endswith("\n") else "\n") + closer)
+                cur = opener
+            cur += seg
+    pieces.append(cur)
+    return pieces
+
+
+def chunk_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into Discord-sized messages. Whole paragraphs and code blocks
+    are kept together when they fit; a code block longer than one message is
+    split between lines and re-fenced so every chunk renders on its own.
+    """
+    chunks: List[str] = []
+    cur = ""
+    for block, fence in _blocks(text):
+        if len(cur) + len(block) <= limit:
+            cur += block
+            continue
+        if fence is None and len(block) > limit:
+            # Oversized prose: top up the current chunk before breaking it.
+            pieces = _split_text(cur + block, limit)
+        else:
+            if cur.strip():
+                chunks.append(cur)
+            if len(block) <= limit:
+                cur = block
+                continue
+            pieces = _split_code(block, fence, limit)
+        chunks.extend(p for p in pieces[:-1] if p.strip())
+        cur = pieces[-1]
+    if cur.strip():
+        chunks.append(cur)
+    return [c.rstrip() for c in chunks]
+
+
+# ---------- pacing ----------
+
+class TokenBucket:
+    def __init__(self, capacity: int, per_seconds: float):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float):
+        """Empty the bucket and pause it, e.g. after a 429."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+def _retry_after(exc: Exception) -> Tuple[Optional[float], bool]:
+    """(seconds to wait, is_global) from a rate-limit error, if it carries one."""
+    if isinstance(exc, discord.RateLimited):
+        return exc.retry_after, False
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("Retry-After", "X-RateLimit-Reset-After"):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value), headers.get("X-RateLimit-Global", "").lower() == "true"
+            except ValueError:
+                pass
+    return None, False
+
+
+class _Item:
+    __slots__ = ("chunks", "done", "enqueued")
+
+    def __init__(self, chunks: List[str], done: asyncio.Future):
+        self.chunks = chunks
+        self.done = done
+        self.enqueued = time.monotonic()
+
+
+class Outbox:
+    def __init__(
+        self,
+        channel_rate: Tuple[int, float] = (5, 5.0),
+        global_rate: Tuple[int, float] = (50, 1.0),
+        max_retries: int = 5,
+        idle_timeout: float = 30.0,
+    ):
+        self.channel_rate = channel_rate
+        self.max_retries = max_retries
+        self.idle_timeout = idle_timeout
+        self._global = TokenBucket(*global_rate)
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._pending_chunks = 0
+
+    def enqueue(self, channel, text: str) -> asyncio.Future:
+        """
+        Queue text for delivery and return at once. The returned future
+        resolves to True once every chunk is sent, False if delivery failed;
+        awaiting it is optional.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        chunks = chunk_message(text)
+        if not chunks:
+            done.set_result(True)
+            return done
+
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = asyncio.Queue()
+            self._buckets[channel.id] = TokenBucket(*self.channel_rate)
+            self._workers[channel.id] = loop.create_task(self._worker(channel))
+        queue.put_nowait(_Item(chunks, done))
+        self._pending_chunks += len(chunks)
+        metrics.set_queue_depth("outbound_chunks", self._pending_chunks)
+        return done
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Wait until every queued message has been delivered or dropped."""
+        queues = list(self._queues.values())
+        if queues:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in queues)), timeout)
+
+    async def close(self, timeout: Optional[float] = 10.0):
+        try:
+            await self.flush(timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in list(self._workers.values()):
+            task.cancel()
+
+    async def _worker(self, channel):
+        cid = channel.id
+        queue = self._queues[cid]
+        bucket = self._buckets[cid]
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # No await between this check and removal, so a concurrent
+                    # enqueue either saw this queue or will create a new one.
+                    del self._queues[cid], self._buckets[cid], self._workers[cid]
+                    return
+                continue
+            metrics.registry.observe(
+                "agent_outbound_queue_seconds",
+                time.monotonic() - item.enqueued,
+                help="Time a reply waited before its first chunk was sent.",
+            )
+            delivered = True
+            for i, chunk in enumerate(item.chunks):
+                try:
+                    sent = await self._send(channel, bucket, chunk)
+                except Exception as exc:
+                    print(f"Unexpected error sending to channel {cid}: {exc!r}")
+                    sent = False
+                if not sent:
+                    delivered = False
+                    self._pending_chunks -= len(item.chunks) - i
+                    break
+                self._pending_chunks -= 1
+            metrics.set_queue_depth("outbound_chunks", self._pending_chunks)
+            if not item.done.done():
+                item.done.set_result(delivered)
+            queue.task_done()
+
+    async def _send(self, channel, bucket: TokenBucket, chunk: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self._global.acquire()
+            await bucket.acquire()
+            start = time.perf_counter()
+            try:
+                await channel.send(chunk, allowed_mentions=discord.AllowedMentions.none())
+            except (discord.Forbidden, discord.NotFound) as exc:
+                print(f"Dropping reply to channel {channel.id}: {exc}")
+                metrics.registry.inc("agent_outbound_sends_total", help="Outbound chunk sends.", outcome="dropped")
+                return False
+            except (discord.HTTPException, discord.RateLimited, aiohttp.ClientConnectorError) as exc:
+                # Only retry what cannot have posted the chunk: rate limits and
+                # failures to connect. discord.py already retries 5xx itself.
+                if isinstance(exc, discord.HTTPException) and exc.status != 429:
+                    print(f"Dropping reply to channel {channel.id}: {exc}")
+                    metrics.registry.inc("agent_outbound_sends_total", outcome="dropped")
+                    return False
+                wait, is_global = _retry_after(exc)
+                if wait is not None:
+                    (self._global if is_global else bucket).block_for(wait)
+                # Full jitter on top of any server-provided wait.
+                delay = (wait or 0.0) + random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+                metrics.registry.inc("agent_outbound_sends_total", outcome="retry")
+                await asyncio.sleep(delay)
+                continue
+            except (OSError, asyncio.TimeoutError) as exc:
+                # The request may have reached Discord, so a retry could post the chunk twice.
+                print(f"Dropping reply to channel {channel.id}, it may be partly delivered: {exc!r}")
+                metrics.registry.inc("agent_outbound_sends_total", outcome="dropped")
+                return False
+            metrics.registry.observe(
+                "agent_outbound_send_seconds",
+                time.perf_counter() - start,
+                help="Latency of one channel.send call.",
+            )
+            metrics.registry.inc("agent_outbound_sends_total", outcome="ok")
+            return True
+        metrics.registry.inc("agent_outbound_sends_total", outcome="gave_up")
+        print(f"Giving up on reply to channel {channel.id} after {self.max_retries} retries")
+        return False
+
+
+outbox = Outbox()
@@ -0,0 +1,370 @@
+# replay.py
+"""
+Replay captured production traffic (see capture.py) against this checkout and
+report latency and query counts.
+
+    python replay.py capture.jsonl.gz --out before.json          # back to back
+    python replay.py capture.jsonl.gz --speed 1 --out after.json  # original pacing
+    python replay.py capture.jsonl.gz --speed 10                  # 10x faster
+    python replay.py --compare before.json after.json
+
+Each captured message goes through the bot's message handler on a fresh
+SQLite database (or --database, e.g. one filled by importer.py). Model calls
+are answered from the capture, matched by event and call order, so two
+builds see the same inputs and outputs; calls the capture has no answer for
+are counted as misses. Replies are delivered to stub channels without rate
+limits. The report also holds the latencies recorded in production.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import capture
+import metrics
+import storage
+
+MISSING_RESPONSE = ""
+
+
+# ---------- reading captures ----------
+
+def _lines(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as fh:
+        try:
+            for line in fh:
+                yield line
+        except (EOFError, gzip.BadGzipFile):
+            # The recording process died mid-write; keep what was flushed.
+            print(f"{path}: truncated capture, stopping at the last complete record")
+
+
+def load_captures(paths: List[str]) -> Tuple[List[dict], Dict[Tuple, dict], Dict[str, dict]]:
+    """
+    (message events ordered by time, llm records by (event, provider, n),
+    done records by event). Event keys are "<file>.<run>:<seq>" so several
+    files and process restarts never collide.
+    """
+    events: List[dict] = []
+    llm: Dict[Tuple, dict] = {}
+    done: Dict[str, dict] = {}
+    for index, path in enumerate(paths):
+        run = 0
+        for line in _lines(path):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partial last line
+            kind = rec.get("type")
+            if kind == "start":
+                run += 1
+                continue
+            if "seq" not in rec:
+                continue
+            key = f"{index}.{run}:{rec['seq']}"
+            if kind == "message":
+                rec["key"] = key
+                events.append(rec)
+            elif kind == "llm":
+                llm[(key, rec["provider"], rec["n"])] = rec
+            elif kind == "done":
+                done[key] = rec
+    events.sort(key=lambda e: e["t"])
+    return events, llm, done
+
+
+# ---------- stand-ins for Discord and the model APIs ----------
+
+class _Channel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sent = 0
+
+    async def send(self, content: str, **kwargs):
+        self.sent += 1
+
+
+def _user(user_id: int) -> SimpleNamespace:
+    name = f"user-{user_id % 10**6:06d}"
+    return SimpleNamespace(id=user_id, bot=False, name=name, display_name=name)
+
+
+class ModelStub:
+    """Answers OpenAI and Gemini calls with the captured responses."""
+
+    def __init__(self, llm: Dict[Tuple, dict], latency_scale: Optional[float]):
+        self.llm = llm
+        self.latency_scale = latency_scale
+        self.misses = 0
+        self.openai = SimpleNamespace(responses=SimpleNamespace(create=self._openai))
+        self.gemini = SimpleNamespace(models=SimpleNamespace(generate_content=self._gemini))
+
+    def _lookup(self, provider: str) -> Optional[dict]:
+        scope = capture.current_scope()
+        rec = self.llm.get((scope.seq, provider, scope.next_call(provider))) if scope else None
+        if rec is None:
+            self.misses += 1
+            return None
+        if self.latency_scale:
+            time.sleep(rec["ms"] / 1000 / self.latency_scale)
+        if not rec["ok"]:
+            raise RuntimeError("model call failed in the capture")
+        return rec
+
+    def _openai(self, **kwargs):
+        rec = self._lookup("openai") or {}
+        return SimpleNamespace(
+            id="replay",
+            output=[],
+            output_text=rec.get("response") or MISSING_RESPONSE,
+            usage=SimpleNamespace(input_tokens=rec.get("input", 0), output_tokens=rec.get("output", 0)),
+        )
+
+    def _gemini(self, **kwargs):
+        rec = self._lookup("gemini") or {}
+        return SimpleNamespace(
+            text=rec.get("response") or MISSING_RESPONSE,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=rec.get("input", 0),
+                candidates_token_count=rec.get("output", 0),
+            ),
+        )
+
+
+# ---------- replay ----------
+
+class Replayer:
+    def __init__(self, events: List[dict], stub: ModelStub):
+        import app
+        import bot
+        import memory
+        from outbound import Outbox
+
+        self.events = events
+        self.stub = stub
+        self.bot = bot
+        app._openai_client = stub.openai
+        memory._client = stub.gemini
+        # Delivery pacing is not what we are measuring.
+        bot.outbox = Outbox(channel_rate=(10**6, 1.0), global_rate=(10**6, 1.0))
+        self.self_user = SimpleNamespace(id=0, bot=True, name="agent", display_name="agent")
+        self.channels: Dict[int, _Channel] = {}
+        self.results: List[Tuple[str, dict]] = []
+        self.errors = 0
+
+    def _message(self, ev: dict) -> SimpleNamespace:
+        channel = self.channels.get(ev["channel"])
+        if channel is None:
+            channel = self.channels[ev["channel"]] = _Channel(ev["channel"])
+        if ev["self"]:
+            author = self.self_user
+        else:
+            author = SimpleNamespace(id=ev["author"], bot=ev["bot"], name=ev["author_name"], display_name=ev["author_name"])
+        mentions = ([self.self_user] if ev["mentioned"] else []) + [_user(u) for u in ev["mentions"]]
+        reference = None
+        if ev["reference"] is not None:
+            root = SimpleNamespace(id=ev["root"], reference=None) if ev["root"] is not None else None
+            reference = SimpleNamespace(message_id=ev["reference"], resolved=root)
+        return SimpleNamespace(
+            id=ev["id"],
+            content=ev["content"],
+            author=author,
+            channel=channel,
+            guild=SimpleNamespace(id=ev["guild"]) if ev["guild"] is not None else None,
+            mentions=mentions,
+            reference=reference,
+        )
+
+    async def _handle(self, ev: dict):
+        message = self._message(ev)
+        kind = "mention" if ev["mentioned"] else "message"
+        with capture.bind(ev["key"]), metrics.request(kind) as trace:
+            try:
+                await self.bot._handle_message(message, self.self_user, ev["mentioned"])
+            except Exception as exc:
+                self.errors += 1
+                if self.errors <= 5:
+                    print(f"Event {ev['key']} failed: {exc!r}")
+            result = trace.as_dict()
+        self.results.append((kind, result))
+
+    async def run(self, speed: float):
+        if speed <= 0:
+            for ev in self.events:
+                await self._handle(ev)
+        elif self.events:
+            loop = asyncio.get_running_loop()
+            start, t0 = loop.time(), self.events[0]["t"]
+            tasks = []
+            for ev in self.events:
+                delay = (ev["t"] - t0) / speed - (loop.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self._handle(ev)))
+            await asyncio.gather(*tasks)
+        await self.bot.outbox.flush(timeout=60)
+
+
+# ---------- reports ----------
+
+def _pct(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def summarize_results(results: List[Tuple[str, dict]]) -> Dict[str, Any]:
+    kinds: Dict[str, List[dict]] = {}
+    spans: Dict[str, List[float]] = {}
+    for kind, r in results:
+        kinds.setdefault(kind, []).append(r)
+        for name, ms in (r.get("spans_ms") or {}).items():
+            spans.setdefault(name, []).append(ms)
+    out: Dict[str, Any] = {"kinds": {}, "spans": {}}
+    for kind, rows in sorted(kinds.items()):
+        lat = sorted(r["total_ms"] for r in rows)
+        out["kinds"][kind] = {
+            "count": len(rows),
+            "mean_ms": round(sum(lat) / len(lat), 3),
+            "p50_ms": _pct(lat, 0.5),
+            "p95_ms": _pct(lat, 0.95),
+            "p99_ms": _pct(lat, 0.99),
+            "db_queries_total": sum(r["db_queries"] for r in rows),
+            "db_queries_mean": round(sum(r["db_queries"] for r in rows) / len(rows), 3),
+            "db_ms_mean": round(sum(r["db_ms"] for r in rows) / len(rows), 3),
+            "llm_calls_total": sum(len(r.get("llm") or []) for r in rows),
+        }
+    for name, values in sorted(spans.items()):
+        ordered = sorted(values)
+        out["spans"][name] = {
+            "count": len(ordered),
+            "p50_ms": _pct(ordered, 0.5),
+            "p95_ms": _pct(ordered, 0.95),
+            "total_ms": round(sum(ordered), 3),
+        }
+    return out
+
+
+def replay(
+    paths: List[str],
+    speed: float = 0.0,
+    model_latency: Optional[str] = None,
+    database: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    events, llm, done = load_captures(paths)
+    if limit:
+        events = events[:limit]
+    if model_latency is None:
+        model_latency = "recorded" if speed > 0 else "none"
+    stub = ModelStub(llm, (speed or 1.0) if model_latency == "recorded" else None)
+
+    tmpdir = None
+    if database is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix="replay-")
+        database = os.path.join(tmpdir.name, "replay.sqlite3")
+    backend = storage.SQLiteBackend(database)
+    storage.set_backend(backend)
+    try:
+        replayer = Replayer(events, stub)
+        started = time.perf_counter()
+        asyncio.run(replayer.run(speed))
+        wall = time.perf_counter() - started
+    finally:
+        backend.close()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    llm_per_event = Counter(key for key, _, _ in llm)
+    recorded = [
+        ("mention" if ev["mentioned"] else "message", {**done[ev["key"]], "llm": [None] * llm_per_event[ev["key"]]})
+        for ev in events
+        if ev["key"] in done and "total_ms" in done[ev["key"]]
+    ]
+    return {
+        "captures": paths,
+        "events": len(events),
+        "speed": speed,
+        "model_latency": model_latency,
+        "wall_s": round(wall, 3),
+        "errors": replayer.errors,
+        "llm_misses": stub.misses,
+        "replies_sent": sum(c.sent for c in replayer.channels.values()),
+        "replayed": summarize_results(replayer.results),
+        "recorded": summarize_results(recorded),
+    }
+
+
+def compare(a: Dict[str, Any], b: Dict[str, Any]) -> List[str]:
+    """Table of replayed metrics in report ``a`` vs ``b``."""
+    rows = [("metric", "a", "b", "change")]
+
+    def add(name: str, x: Optional[float], y: Optional[float]):
+        if x is None and y is None:
+            return
+        change = ""
+        if x and y is not None:
+            change = f"{(y - x) / x * 100:+.1f}%"
+        rows.append((name, "-" if x is None else f"{x:g}", "-" if y is None else f"{y:g}", change))
+
+    for field in ("events", "wall_s", "errors", "llm_misses"):
+        add(field, a.get(field), b.get(field))
+    ra, rb = a["replayed"], b["replayed"]
+    for kind in sorted(set(ra["kinds"]) | set(rb["kinds"])):
+        ka, kb = ra["kinds"].get(kind, {}), rb["kinds"].get(kind, {})
+        for field in ("count", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "db_queries_mean", "db_ms_mean"):
+            add(f"{kind}.{field}", ka.get(field), kb.get(field))
+    for name in sorted(set(ra["spans"]) | set(rb["spans"])):
+        sa, sb = ra["spans"].get(name, {}), rb["spans"].get(name, {})
+        for field in ("p50_ms", "p95_ms"):
+            add(f"span.{name}.{field}", sa.get(field), sb.get(field))
+
+    widths = [max(len(r[i]) for r in rows) for i in range(4)]
+    return ["  ".join(cell.ljust(w) for cell, w in zip(r, widths)).rstrip() for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="*", help="capture files written with CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = original pacing, 10 = 10x faster, 0 = back to back")
+    parser.add_argument(
+        "--model-latency",
+        choices=["recorded", "none"],
+        default=None,
+        help="sleep for the recorded model latency (default: recorded when --speed > 0)",
+    )
+    parser.add_argument("--database", default=None, help="SQLite file to replay into (default: a fresh temp file)")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N events")
+    parser.add_argument("--out", default=None, help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two reports instead of replaying")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as fa, open(args.compare[1]) as fb:
+            print("\n".join(compare(json.load(fa), json.load(fb))))
+        return 0
+    if not args.captures:
+        parser.error("give at least one capture file, or --compare A B")
+
+    report = replay(args.captures, args.speed, args.model_latency, args.database, args.limit)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text + "\n")
+        print(f"Replayed {report['events']} events in {report['wall_s']}s; report written to {args.out}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
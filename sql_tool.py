@@ -0,0 +1,234 @@
+# sql_tool.py
+"""
+Local read-only SQL tool for OpenAI function calling.
+
+An alternative to the remote MCP server: the model calls ``query_database``
+and the bot runs the query itself through its storage backend, so a data
+question costs no extra network hop. Queries must be a single SELECT/WITH
+over allow-listed tables, take their values as ``%s`` parameters, and run
+read-only under a statement timeout and row limit. Results are cached for a
+short TTL keyed on the normalized SQL and parameters.
+
+validate_query is a first filter with readable errors; the allow-list is
+enforced by the engine (see StorageBackend.run_readonly). On Postgres that
+means running ``python db_init.py`` after changing SQL_TOOL_ALLOWED_TABLES.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+from storage import StorageBackend, get_backend
+
+TOOL_NAME = "query_database"
+
+SQL_TOOL_ALLOWED_TABLES = frozenset(
+    t.strip().lower()
+    for t in os.getenv("SQL_TOOL_ALLOWED_TABLES", "messages,threads,turns,profiles,team_facts").split(",")
+    if t.strip()
+)
+SQL_TOOL_TIMEOUT_MS = int(os.getenv("SQL_TOOL_TIMEOUT_MS", "2000"))
+SQL_TOOL_MAX_ROWS = int(os.getenv("SQL_TOOL_MAX_ROWS", "50"))
+SQL_TOOL_CACHE_TTL = float(os.getenv("SQL_TOOL_CACHE_TTL", "30"))
+SQL_TOOL_CACHE_SIZE = int(os.getenv("SQL_TOOL_CACHE_SIZE", "256"))
+# Cell values are cut to this many characters in tool output.
+SQL_TOOL_MAX_CELL_CHARS = 500
+
+TOOL_DEFINITION: Dict[str, Any] = {
+    "type": "function",
+    "name": TOOL_NAME,
+    "description": (
+        "Run one read-only SQL SELECT against the bot's database. "
+        f"Tables: {', '.join(sorted(SQL_TOOL_ALLOWED_TABLES))}. "
+        "messages(message_id, channel_id, guild_id, author_id, author_name, content, is_bot, reference_id, created_at); "
+        "threads(thread_key, summary); turns(thread_key, role, text, ts); "
+        "profiles(user_id, fact, ts); team_facts(guild_id, fact, ts). "
+        "Pass every literal value (including LIKE patterns) as a %s placeholder in `params`. "
+        f"At most {SQL_TOOL_MAX_ROWS} rows are returned."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "sql": {"type": "string", "description": "A single SELECT (or WITH ... SELECT) statement."},
+            "params": {
+                "type": "array",
+                "items": {"type": ["string", "number", "boolean", "null"]},
+                "description": "Values for the %s placeholders, in order.",
+            },
+        },
+        "required": ["sql", "params"],
+        "additionalProperties": False,
+    },
+    "strict": True,
+}
+
+
+class QueryRejected(ValueError):
+    """The query is not a single, read-only, allow-listed SELECT."""
+
+
+_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_FORBIDDEN_RE = re.compile(
+    r"\b(insert|update|delete|merge|upsert|drop|alter|create|truncate|grant|revoke|copy|vacuum|analyze|"
+    r"call|do|execute|prepare|deallocate|listen|notify|set|reset|lock|into|attach|detach|pragma|table|"
+    r"pg_\w+|lo_\w+|dblink\w*|query_to_\w+|\w+_to_xml\w*|current_setting|set_config|load_extension)\b",
+    re.I,
+)
+_FROM_LIST_RE = re.compile(
+    r"\bfrom\s+([^()]+?)(?=\b(?:where|group|order|limit|offset|having|union|intersect|except|join|left|right|"
+    r"inner|full|cross|natural|window|on|using|fetch|for)\b|[()]|$)",
+    re.I,
+)
+_JOIN_RE = re.compile(r"\bjoin\s+([a-z_][\w.]*)", re.I)
+_PAREN_TABLE_RE = re.compile(r"\b(?:from|join)\s*\(+\s*([a-z_][\w.]*)\s*\)", re.I)
+_CTE_RE = re.compile(r"(?:\bwith\b|,)\s*(?:recursive\s+)?([a-z_]\w*)\s*(?:\([^)]*\)\s*)?as\s*\(", re.I)
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and case outside quoted literals/identifiers."""
+    parts = _LITERAL_RE.split(sql.strip().rstrip(";").strip())
+    out = []
+    for i, part in enumerate(parts):
+        out.append(part if i % 2 else re.sub(r"\s+", " ", part).lower())
+    return "".join(out).strip()
+
+
+def _in_function_call(code: str, pos: int) -> bool:
+    """
+    Whether ``pos`` sits in parentheses that are not a subquery, such as
+    the FROM in extract(epoch from ...), substring(... from ...) or trim().
+    """
+    depth = 0
+    for i in range(pos - 1, -1, -1):
+        if code[i] == ")":
+            depth += 1
+        elif code[i] == "(":
+            if depth == 0:
+                return not re.match(r"\s*(?:select|with)\b", code[i + 1:])
+            depth -= 1
+    return False
+
+
+def _referenced_tables(code: str) -> List[str]:
+    """Names after FROM (including comma lists) and JOIN; subqueries are skipped."""
+    names = []
+    for match in _FROM_LIST_RE.finditer(code):
+        if _in_function_call(code, match.start()):
+            continue
+        for item in match.group(1).split(","):
+            words = item.split()
+            if words:
+                names.append(words[0])
+    names.extend(_JOIN_RE.findall(code))
+    names.extend(m.group(1) for m in _PAREN_TABLE_RE.finditer(code) if not _in_function_call(code, m.start()))
+    return names
+
+
+def validate_query(sql: str, params: Sequence[Any]) -> str:
+    """Return the normalized SQL, or raise QueryRejected."""
+    normalized = normalize_sql(sql)
+    code = _LITERAL_RE.sub("''", normalized)  # literals cannot smuggle keywords
+    if not code:
+        raise QueryRejected("empty query")
+    if '"' in normalized:
+        raise QueryRejected("quoted identifiers are not allowed")
+    if any("%" in lit for lit in _LITERAL_RE.findall(normalized)):
+        # psycopg2 would read it as a placeholder.
+        raise QueryRejected("pass LIKE patterns and other values containing '%' as %s parameters")
+    if ";" in code:
+        raise QueryRejected("only one statement is allowed")
+    if "--" in code or "/*" in code:
+        raise QueryRejected("comments are not allowed")
+    if not re.match(r"^(select|with)\b", code):
+        raise QueryRejected("only SELECT queries are allowed")
+    bad = _FORBIDDEN_RE.search(code)
+    if bad:
+        raise QueryRejected(f"'{bad.group(1)}' is not allowed")
+    ctes = {name.lower() for name in _CTE_RE.findall(code)}
+    for table in _referenced_tables(code):
+        name = table.lower()
+        if name.startswith("public."):
+            name = name[len("public."):]
+        if name not in SQL_TOOL_ALLOWED_TABLES and name not in ctes:
+            raise QueryRejected(f"table '{table}' is not allowed")
+    if code.count("%s") != len(params) or "%" in code.replace("%s", ""):
+        raise QueryRejected("use one %s placeholder per parameter and no other '%'")
+    return normalized
+
+
+class _TTLCache:
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None:
+                return None
+            expires, value = hit
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: Dict[str, Any]):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_cache = _TTLCache(SQL_TOOL_CACHE_TTL, SQL_TOOL_CACHE_SIZE)
+
+
+def _cell(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= SQL_TOOL_MAX_CELL_CHARS else text[:SQL_TOOL_MAX_CELL_CHARS] + "…"
+
+
+def run_query(sql: str, params: Sequence[Any], backend: Optional[StorageBackend] = None) -> Dict[str, Any]:
+    """Validate, then serve from cache or run read-only on the backend."""
+    normalized = validate_query(sql, params)
+    key = (normalized, tuple(params))
+    cached = _cache.get(key)
+    if cached is not None:
+        metrics.registry.inc("agent_sql_tool_cache_total", help="SQL tool cache lookups.", result="hit")
+        return {**cached, "cached": True}
+    metrics.registry.inc("agent_sql_tool_cache_total", help="SQL tool cache lookups.", result="miss")
+
+    columns, rows, truncated = (backend or get_backend()).run_readonly(
+        normalized, params, SQL_TOOL_TIMEOUT_MS, SQL_TOOL_MAX_ROWS, SQL_TOOL_ALLOWED_TABLES
+    )
+    result = {
+        "columns": columns,
+        "rows": [[_cell(v) for v in row] for row in rows],
+        "truncated": truncated,
+    }
+    _cache.put(key, result)
+    return {**result, "cached": False}
+
+
+def run_tool_call(arguments: str, backend: Optional[StorageBackend] = None) -> str:
+    """Handle one ``query_database`` function call; always returns JSON text."""
+    try:
+        args = json.loads(arguments or "{}")
+        result = run_query(args.get("sql", ""), args.get("params") or [], backend=backend)
+    except QueryRejected as exc:
+        metrics.registry.inc("agent_sql_tool_calls_total", help="SQL tool calls.", outcome="rejected")
+        return json.dumps({"error": f"query rejected: {exc}"})
+    except Exception as exc:
+        metrics.registry.inc("agent_sql_tool_calls_total", help="SQL tool calls.", outcome="error")
+        return json.dumps({"error": f"query failed: {exc}"})
+    metrics.registry.inc("agent_sql_tool_calls_total", help="SQL tool calls.", outcome="ok")
+    return json.dumps(result, default=str)
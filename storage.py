@@ -0,0 +1,864 @@
+# storage.py
+"""
+Storage backends behind Memory and the message logger.
+
+Callers write plain SQL with ``%s`` placeholders (the Postgres dialect used
+throughout the project) and read rows as dictionaries:
+
+    with get_backend().cursor(write=True) as cur:
+        cur.execute("INSERT INTO ... VALUES (%s)", (x,))
+
+Select the backend with STORAGE_BACKEND=postgres|sqlite (default postgres).
+The SQLite backend stores everything in SQLITE_PATH (default agent.sqlite3).
+"""
+import hashlib
+import io
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import metrics
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "agent.sqlite3")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Postgres role run_readonly switches to; db_init grants it SELECT on the SQL tool's tables.
+DB_READONLY_ROLE = os.getenv("DB_READONLY_ROLE", "agent_readonly")
+
+
+class Session:
+    """Cursor wrapper shared by every backend: dict rows, timed statements."""
+
+    def __init__(self, cursor, translate: Callable[[str], str] = lambda sql: sql):
+        self._cursor = cursor
+        self._translate = translate
+
+    def execute(self, sql: str, params: Sequence[Any] = ()):
+        start = time.perf_counter()
+        ok = False
+        try:
+            self._cursor.execute(self._translate(sql), tuple(params))
+            ok = True
+        finally:
+            metrics.observe_query(sql, time.perf_counter() - start, ok)
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        return [dict(r) for r in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+
+class StorageBackend:
+    """Interface implemented by each engine."""
+
+    name = "base"
+
+    @contextmanager
+    def cursor(self, write: bool = False) -> Iterator[Session]:
+        """
+        Yield a Session inside one transaction; commit on success, roll back
+        on error. ``write=False`` lets an engine serve the block from a
+        read-only path.
+        """
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    @contextmanager
+    def try_lock(self, name: str) -> Iterator[bool]:
+        """
+        Non-blocking named lock shared by every worker using this database.
+        Yields True while held, False if someone else holds it.
+        """
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    # ---------- full-text search over messages ----------
+    def ensure_search_schema(self):
+        """Create the search index structures for ``messages``."""
+        raise NotImplementedError
+
+    def index_pending_messages(self, batch_size: int = 2000) -> int:
+        """Index up to ``batch_size`` not-yet-indexed messages; return how many."""
+        raise NotImplementedError
+
+    def search_messages(
+        self, channel_id: str, terms: Sequence[str], before: datetime, limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Best-ranked messages in a channel created before ``before`` matching
+        any of ``terms`` (prefix match). Terms must be plain word characters.
+        """
+        raise NotImplementedError
+
+    def run_readonly(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        timeout_ms: int,
+        max_rows: int,
+        allowed_tables: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], List[tuple], bool]:
+        """
+        Run one already-validated SELECT in a read-only transaction with a
+        statement timeout. Returns (columns, rows, truncated); at most
+        ``max_rows`` rows are fetched. The engine itself refuses reads outside
+        ``allowed_tables``: SQLite through an authorizer, Postgres by running
+        as DB_READONLY_ROLE (see ensure_readonly_role).
+        """
+        raise NotImplementedError
+
+    def ensure_readonly_role(self, tables: Collection[str]):
+        """Set up engine-side read permissions for run_readonly, if the engine needs any."""
+
+    # ---------- bulk import / background fact queue ----------
+    def get_import_progress(self, source: str) -> int:
+        """Records of ``source`` already committed by the importer."""
+        with self.cursor() as cur:
+            cur.execute("SELECT records FROM import_progress WHERE source = %s", (source,))
+            row = cur.fetchone()
+        return int(row["records"]) if row else 0
+
+    def import_batch(
+        self,
+        rows: Sequence[tuple],
+        source: str,
+        records_done: int,
+        fact_batches: Sequence[tuple] = (),
+    ) -> int:
+        """
+        In one transaction: insert ``rows`` (IMPORT_COLUMNS order) into
+        messages, skipping message_ids already present; queue
+        ``fact_batches`` ((user_id, guild_id, text) tuples); and record
+        ``records_done`` as the source's resume point. Returns rows inserted.
+        """
+        inserted = 0
+        with self.cursor(write=True) as cur:
+            for row in rows:
+                cur.execute(_INSERT_IF_NEW, (*row, row[0]))
+                inserted += max(cur.rowcount, 0)
+            self._finish_import_batch(cur, source, records_done, fact_batches)
+        return inserted
+
+    def _finish_import_batch(self, cur: Session, source: str, records_done: int, fact_batches: Sequence[tuple]):
+        now = time.time()
+        for user_id, guild_id, text in fact_batches:
+            cur.execute(
+                "INSERT INTO fact_queue(user_id, guild_id, text, ts) VALUES (%s, %s, %s, %s)",
+                (user_id, guild_id, text, now),
+            )
+        cur.execute(
+            """
+            INSERT INTO import_progress(source, records, updated_at) VALUES (%s, %s, %s)
+            ON CONFLICT(source) DO UPDATE SET records = EXCLUDED.records, updated_at = EXCLUDED.updated_at
+            """,
+            (source, records_done, now),
+        )
+
+    def claim_fact_batches(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Remove and return up to ``limit`` queued fact-extraction batches;
+        hand any that could not be processed back with requeue_fact_batches.
+        """
+        with self.cursor(write=True) as cur:
+            cur.execute(
+                """
+                DELETE FROM fact_queue
+                WHERE id IN (SELECT id FROM fact_queue ORDER BY id LIMIT %s)
+                RETURNING user_id, guild_id, text, ts
+                """,
+                (limit,),
+            )
+            return cur.fetchall()
+
+    def requeue_fact_batches(self, batches: Sequence[Dict[str, Any]]):
+        """Put claimed batches back on the queue (behind newer ones)."""
+        with self.cursor(write=True) as cur:
+            for batch in batches:
+                cur.execute(
+                    "INSERT INTO fact_queue(user_id, guild_id, text, ts) VALUES (%s, %s, %s, %s)",
+                    (batch["user_id"], batch["guild_id"], batch["text"], batch["ts"]),
+                )
+
+    def execute_script(self, statements: Sequence[str]):
+        with self.cursor(write=True) as cur:
+            for stmt in statements:
+                cur.execute(stmt)
+
+    def close(self):
+        pass
+
+
+# Column order of rows passed to import_batch.
+IMPORT_COLUMNS = (
+    "message_id", "channel_id", "guild_id", "author_id", "author_name",
+    "content", "is_bot", "reference_id", "created_at",
+)
+_INSERT_IF_NEW = (
+    f"INSERT INTO messages ({', '.join(IMPORT_COLUMNS)}) "
+    f"SELECT {', '.join(['%s'] * len(IMPORT_COLUMNS))} "
+    "WHERE NOT EXISTS (SELECT 1 FROM messages WHERE message_id = %s)"
+)
+
+
+def advisory_key(name: str) -> int:
+    """Stable signed 64-bit key for a lock name (Python's hash() is salted)."""
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+# ---------- PostgreSQL ----------
+
+# Search indexes built by PostgresBackend.ensure_search_schema.
+_SEARCH_INDEXES = (
+    ("idx_msgs_content_tsv", "messages USING GIN (content_tsv)"),
+    ("idx_msgs_tsv_pending", "messages(id) WHERE content_tsv IS NULL"),
+)
+
+
+def _index_valid(cur, index: str) -> Optional[bool]:
+    """pg_index.indisvalid for ``index``, or None if it does not exist."""
+    cur.execute(
+        "SELECT i.indisvalid AS ok FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+        (index,),
+    )
+    row = cur.fetchone()
+    return None if row is None else bool(row["ok"])
+
+
+class PostgresBackend(StorageBackend):
+    name = "postgres"
+
+    def __init__(self, dsn: Optional[str] = None, minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+        from psycopg2.extras import RealDictCursor
+        from psycopg2.pool import ThreadedConnectionPool
+
+        from db_postgres import get_database_url
+
+        self._pool = ThreadedConnectionPool(
+            minconn, maxconn, dsn or get_database_url(), cursor_factory=RealDictCursor
+        )
+        # ThreadedConnectionPool raises when exhausted; block instead.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # Connection pinned by try_lock() for the holding thread.
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a raw psycopg2 connection from the pool. While this thread
+        holds a try_lock(), that lock's connection is reused instead, so a
+        lock holder never waits on the pool for a second one.
+        """
+        pinned = getattr(self._local, "conn", None)
+        if pinned is not None:
+            yield pinned
+            return
+        self._slots.acquire()
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            self._pool.putconn(conn)
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self, write: bool = False) -> Iterator[Session]:
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    yield Session(cur)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def try_lock(self, name: str) -> Iterator[bool]:
+        # Session-level advisory lock, so it survives across the caller's own
+        # transactions. Its connection is pinned to this thread while held,
+        # and the caller's queries run on it (see connection()).
+        lock_key = advisory_key(name)
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (lock_key,))
+                acquired = bool(cur.fetchone()["ok"])
+            conn.commit()
+            if not acquired:
+                yield False
+                return
+            outer = getattr(self._local, "conn", None)
+            self._local.conn = conn
+            try:
+                yield True
+            finally:
+                self._local.conn = outer
+                conn.rollback()  # never unlock from inside an aborted transaction
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (lock_key,))
+                conn.commit()
+
+    def ensure_search_schema(self):
+        # Every worker calls this at startup; one builds, the others wait.
+        # They poll rather than block in pg_advisory_lock, because a waiting
+        # statement holds a snapshot that CREATE INDEX CONCURRENTLY waits on.
+        while not self._search_schema_ready():
+            with self.try_lock("search_schema") as acquired:
+                if acquired:
+                    self._create_search_schema()
+                    return
+            time.sleep(1.0)
+
+    def _search_schema_ready(self) -> bool:
+        with self.cursor() as cur:
+            cur.execute(
+                """
+                SELECT count(*) AS n FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(%s) AND i.indisvalid
+                """,
+                ([index for index, _ in _SEARCH_INDEXES],),
+            )
+            return cur.fetchone()["n"] == len(_SEARCH_INDEXES)
+
+    def _create_search_schema(self):
+        # CONCURRENTLY keeps existing tables writable while the GIN index
+        # builds; it cannot run inside a transaction block. An interrupted
+        # build leaves an invalid index that IF NOT EXISTS would keep
+        # forever, so such leftovers are dropped and rebuilt.
+        with self.connection() as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector")
+                    for index, definition in _SEARCH_INDEXES:
+                        if _index_valid(cur, index) is False:
+                            print(f"Rebuilding invalid index {index}")
+                            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+                        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {definition}")
+                        if not _index_valid(cur, index):
+                            raise RuntimeError(f"index {index} was not built")
+            finally:
+                conn.autocommit = False
+
+    def index_pending_messages(self, batch_size: int = 2000) -> int:
+        with self.cursor(write=True) as cur:
+            cur.execute(
+                """
+                UPDATE messages SET content_tsv = to_tsvector('simple', COALESCE(content, ''))
+                WHERE id IN (
+                    SELECT id FROM messages
+                    WHERE content_tsv IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                """,
+                (batch_size,),
+            )
+            return cur.rowcount
+
+    def search_messages(
+        self, channel_id: str, terms: Sequence[str], before: datetime, limit: int
+    ) -> List[Dict[str, Any]]:
+        if not terms:
+            return []
+        query = " | ".join(f"{t}:*" for t in terms)
+        with self.cursor() as cur:
+            cur.execute(
+                """
+                SELECT author_id, author_name, content, is_bot, created_at,
+                       ts_rank(content_tsv, q) AS rank
+                FROM messages, to_tsquery('simple', %s) AS q
+                WHERE channel_id = %s
+                  AND created_at < %s
+                  AND content_tsv @@ q
+                ORDER BY rank DESC, created_at DESC
+                LIMIT %s
+                """,
+                (query, channel_id, before, limit),
+            )
+            return cur.fetchall()
+
+    def run_readonly(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        timeout_ms: int,
+        max_rows: int,
+        allowed_tables: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], List[tuple], bool]:
+        # allowed_tables is enforced by DB_READONLY_ROLE's grants, which
+        # ensure_readonly_role sets up; a missing role fails the query.
+        from psycopg2 import sql as pgsql
+        from psycopg2.extensions import cursor as tuple_cursor
+
+        start = time.perf_counter()
+        ok = False
+        with self.connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=tuple_cursor) as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute(pgsql.SQL("SET LOCAL ROLE {}").format(pgsql.Identifier(DB_READONLY_ROLE)))
+                    cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+                    cur.execute(sql, tuple(params))
+                    columns = [d[0] for d in cur.description or []]
+                    fetched = cur.fetchmany(max_rows + 1)
+                ok = True
+            finally:
+                conn.rollback()
+                metrics.observe_query(sql, time.perf_counter() - start, ok)
+        return columns, [tuple(r) for r in fetched[:max_rows]], len(fetched) > max_rows
+
+    def ensure_readonly_role(self, tables: Collection[str]):
+        # Needs CREATEROLE; run once from db_init, not at bot startup.
+        from psycopg2 import sql as pgsql
+
+        role = pgsql.Identifier(DB_READONLY_ROLE)
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1 FROM pg_roles WHERE rolname = %s", (DB_READONLY_ROLE,))
+                    if cur.fetchone() is None:
+                        cur.execute(pgsql.SQL("CREATE ROLE {} NOLOGIN").format(role))
+                    cur.execute(pgsql.SQL("GRANT {} TO CURRENT_USER").format(role))
+                    cur.execute(pgsql.SQL("GRANT USAGE ON SCHEMA public TO {}").format(role))
+                    cur.execute(pgsql.SQL("REVOKE ALL ON ALL TABLES IN SCHEMA public FROM {}").format(role))
+                    cur.execute(
+                        "SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NOT NULL",
+                        (sorted(tables),),
+                    )
+                    existing = [row["t"] for row in cur.fetchall()]
+                    if existing:
+                        cur.execute(
+                            pgsql.SQL("GRANT SELECT ON {} TO {}").format(
+                                pgsql.SQL(", ").join(pgsql.Identifier(t) for t in existing), role
+                            )
+                        )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def import_batch(
+        self,
+        rows: Sequence[tuple],
+        source: str,
+        records_done: int,
+        fact_batches: Sequence[tuple] = (),
+    ) -> int:
+        # COPY into a per-transaction staging table, then one set-based insert.
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(_copy_field(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        cols = ", ".join(IMPORT_COLUMNS)
+        start = time.perf_counter()
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as raw:
+                    raw.execute(
+                        f"CREATE TEMP TABLE import_staging ON COMMIT DROP AS "
+                        f"SELECT {cols} FROM messages WITH NO DATA"
+                    )
+                    raw.copy_expert(f"COPY import_staging ({cols}) FROM STDIN", buf)
+                    metrics.observe_query("COPY import_staging", time.perf_counter() - start)
+                    cur = Session(raw)
+                    cur.execute(
+                        f"""
+                        INSERT INTO messages ({cols})
+                        SELECT DISTINCT ON (s.message_id) {", ".join("s." + c for c in IMPORT_COLUMNS)}
+                        FROM import_staging s
+                        WHERE NOT EXISTS (SELECT 1 FROM messages m WHERE m.message_id = s.message_id)
+                        ORDER BY s.message_id
+                        """
+                    )
+                    inserted = cur.rowcount
+                    self._finish_import_batch(cur, source, records_done, fact_batches)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return inserted
+
+    def claim_fact_batches(self, limit: int) -> List[Dict[str, Any]]:
+        # SKIP LOCKED lets several workers drain the queue without contention.
+        with self.cursor(write=True) as cur:
+            cur.execute(
+                """
+                DELETE FROM fact_queue
+                WHERE id IN (
+                    SELECT id FROM fact_queue ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING user_id, guild_id, text, ts
+                """,
+                (limit,),
+            )
+            return cur.fetchall()
+
+    def close(self):
+        self._pool.closeall()
+
+
+# ---------- SQLite ----------
+
+_DDL_REWRITES = [
+    (re.compile(r"\bBIGSERIAL\s+PRIMARY\s+KEY\b", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\bDOUBLE\s+PRECISION\b", re.I), "REAL"),
+    (re.compile(r"\bTIMESTAMPTZ\b", re.I), "TEXT"),
+    (re.compile(r"\bBOOLEAN(\s+NOT\s+NULL)?\s+DEFAULT\s+FALSE\b", re.I), r"INTEGER\1 DEFAULT 0"),
+    (re.compile(r"\bDEFAULT\s+NOW\(\)", re.I), "DEFAULT CURRENT_TIMESTAMP"),
+]
+
+
+@lru_cache(maxsize=512)
+def sqlite_dialect(sql: str) -> str:
+    """Rewrite the project's Postgres SQL for SQLite. Cached so the same text
+    keeps hitting SQLite's per-connection prepared-statement cache."""
+    out = sql.replace("%s", "?")
+    for pattern, repl in _DDL_REWRITES:
+        out = pattern.sub(repl, out)
+    return out
+
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat())
+sqlite3.register_adapter(bool, int)
+
+
+def _copy_field(value: Any) -> str:
+    """Encode one value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\x00", "")
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+_SQLITE_QUERY_ACTIONS = frozenset({sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE})
+
+
+def _allow_all(*args) -> int:
+    return sqlite3.SQLITE_OK
+
+
+def _readonly_authorizer(allowed_tables: Optional[Collection[str]]):
+    """
+    Authorizer for run_readonly: plain queries only, reading only
+    ``allowed_tables`` (any table if None). SQLite reports every table a
+    statement reads, however it is spelled (subqueries, CTEs, views).
+    """
+    allowed = None if allowed_tables is None else {t.lower() for t in allowed_tables}
+
+    def authorize(action, arg1, arg2, dbname, source) -> int:
+        if action == sqlite3.SQLITE_READ:
+            if allowed is None or (arg1 or "").lower() in allowed:
+                return sqlite3.SQLITE_OK
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK if action in _SQLITE_QUERY_ACTIONS else sqlite3.SQLITE_DENY
+
+    return authorize
+
+
+def _dict_factory(cursor, row):
+    return {col[0]: row[i] for i, col in enumerate(cursor.description)}
+
+
+class _WriterThread(threading.Thread):
+    """Owns the only write connection; runs submitted callables in order."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        super().__init__(name="sqlite-writer", daemon=True)
+        self._connect = connect
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self.conn: Optional[sqlite3.Connection] = None
+        self._ready = threading.Event()
+        self.start()
+        self._ready.wait()
+
+    def run(self):
+        self.conn = self._connect()
+        self._ready.set()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, fut = job
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(self.conn))
+            except BaseException as exc:
+                fut.set_exception(exc)
+            metrics.set_queue_depth("sqlite_writer", self._jobs.qsize())
+        self.conn.close()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        if threading.current_thread() is self:
+            return fn(self.conn)
+        fut: Future = Future()
+        self._jobs.put((fn, fut))
+        return fut.result()
+
+    def stop(self):
+        self._jobs.put(None)
+        self.join()
+
+
+class _WriterCursor:
+    """DB-API cursor facade whose calls execute on the writer thread."""
+
+    def __init__(self, writer: _WriterThread):
+        self._writer = writer
+        self._cur = writer.submit(lambda conn: conn.cursor())
+
+    def execute(self, sql, params=()):
+        return self._writer.submit(lambda conn: self._cur.execute(sql, params))
+
+    def fetchone(self):
+        return self._writer.submit(lambda conn: self._cur.fetchone())
+
+    def fetchall(self):
+        return self._writer.submit(lambda conn: self._cur.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded engine: WAL journal, one dedicated writer thread (writes are
+    serialized there), a connection per reader thread, and SQLite's
+    prepared-statement cache. ``path=":memory:"`` keeps everything on the
+    writer connection.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._memory = path == ":memory:"
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._named_locks: Dict[str, threading.Lock] = {}
+        self._named_locks_guard = threading.Lock()
+        self._writer = _WriterThread(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = _dict_factory
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA busy_timeout=5000")
+        if not self._memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @contextmanager
+    def cursor(self, write: bool = False) -> Iterator[Session]:
+        if write or self._memory:
+            with self._write_lock:
+                self._writer.submit(lambda conn: conn.execute("BEGIN IMMEDIATE" if write else "BEGIN"))
+                try:
+                    yield Session(_WriterCursor(self._writer), sqlite_dialect)
+                    self._writer.submit(lambda conn: conn.execute("COMMIT"))
+                except BaseException:
+                    self._writer.submit(lambda conn: conn.execute("ROLLBACK"))
+                    raise
+            return
+        conn = self._reader()
+        conn.execute("BEGIN")
+        try:
+            yield Session(conn.cursor(), sqlite_dialect)
+        finally:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def try_lock(self, name: str) -> Iterator[bool]:
+        # An SQLite file has a single bot process, so in-process locks suffice.
+        with self._named_locks_guard:
+            lock = self._named_locks.setdefault(name, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+    def ensure_search_schema(self):
+        # External-content FTS5 table over messages.content; search_state
+        # remembers the last indexed id (ids commit in order on one writer).
+        self.execute_script([
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts "
+            "USING fts5(content, content='messages', content_rowid='id')",
+            "CREATE TABLE IF NOT EXISTS search_state (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)",
+            "INSERT OR IGNORE INTO search_state(name, last_id) VALUES ('messages_fts', 0)",
+        ])
+
+    def index_pending_messages(self, batch_size: int = 2000) -> int:
+        with self.cursor(write=True) as cur:
+            cur.execute("SELECT last_id FROM search_state WHERE name = 'messages_fts'")
+            last_id = cur.fetchone()["last_id"]
+            cur.execute(
+                "SELECT MAX(id) AS hi, COUNT(*) AS n FROM "
+                "(SELECT id FROM messages WHERE id > %s ORDER BY id LIMIT %s)",
+                (last_id, batch_size),
+            )
+            row = cur.fetchone()
+            if not row["n"]:
+                return 0
+            cur.execute(
+                "INSERT INTO messages_fts(rowid, content) "
+                "SELECT id, COALESCE(content, '') FROM messages WHERE id > %s AND id <= %s",
+                (last_id, row["hi"]),
+            )
+            cur.execute("UPDATE search_state SET last_id = %s WHERE name = 'messages_fts'", (row["hi"],))
+            return row["n"]
+
+    def search_messages(
+        self, channel_id: str, terms: Sequence[str], before: datetime, limit: int
+    ) -> List[Dict[str, Any]]:
+        if not terms:
+            return []
+        query = " OR ".join(f'"{t}"*' for t in terms)
+        with self.cursor() as cur:
+            cur.execute(
+                """
+                SELECT m.author_id, m.author_name, m.content, m.is_bot, m.created_at,
+                       bm25(messages_fts) AS rank
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH %s
+                  AND m.channel_id = %s
+                  AND m.created_at < %s
+                ORDER BY rank ASC, m.created_at DESC
+                LIMIT %s
+                """,
+                (query, channel_id, before, limit),
+            )
+            return cur.fetchall()
+
+    def run_readonly(
+        self,
+        sql: str,
+        params: Sequence[Any],
+        timeout_ms: int,
+        max_rows: int,
+        allowed_tables: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], List[tuple], bool]:
+        deadline = time.monotonic() + timeout_ms / 1000
+        authorizer = _readonly_authorizer(allowed_tables)
+
+        def run(conn: sqlite3.Connection):
+            # A non-zero progress handler return aborts the statement.
+            conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+            conn.execute("PRAGMA query_only = ON")
+            conn.set_authorizer(authorizer)
+            try:
+                cur = conn.cursor()
+                cur.row_factory = None
+                cur.execute(sqlite_dialect(sql), tuple(params))
+                columns = [d[0] for d in cur.description or []]
+                fetched = cur.fetchmany(max_rows + 1)
+                cur.close()
+            finally:
+                conn.set_authorizer(_allow_all)
+                conn.execute("PRAGMA query_only = OFF")
+                conn.set_progress_handler(None, 0)
+            return columns, fetched
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            if self._memory:
+                with self._write_lock:
+                    columns, fetched = self._writer.submit(run)
+            else:
+                columns, fetched = run(self._reader())
+            ok = True
+        finally:
+            metrics.observe_query(sql, time.perf_counter() - start, ok)
+        return columns, [tuple(r) for r in fetched[:max_rows]], len(fetched) > max_rows
+
+    def import_batch(
+        self,
+        rows: Sequence[tuple],
+        source: str,
+        records_done: int,
+        fact_batches: Sequence[tuple] = (),
+    ) -> int:
+        # One writer job with executemany instead of a thread hop per row.
+        sql = sqlite_dialect(_INSERT_IF_NEW)
+        params = [(*row, row[0]) for row in rows]
+        with self.cursor(write=True) as cur:
+            start = time.perf_counter()
+            inserted = self._writer.submit(lambda conn: conn.executemany(sql, params).rowcount)
+            metrics.observe_query(_INSERT_IF_NEW, time.perf_counter() - start)
+            self._finish_import_batch(cur, source, records_done, fact_batches)
+        return inserted
+
+    def close(self):
+        self._writer.stop()
+
+
+# ---------- process-wide default ----------
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind: str = STORAGE_BACKEND) -> StorageBackend:
+    if kind == "postgres":
+        return PostgresBackend()
+    if kind == "sqlite":
+        return SQLiteBackend()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {kind!r}; use 'postgres' or 'sqlite'.")
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[StorageBackend]):
+    """Swap the default backend (benchmarks, tests, alternative deployments)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,150 @@
+import io
+import json
+
+import pytest
+
+import importer
+import logger
+import storage
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def backend():
+    db = SQLiteBackend(":memory:")
+    storage.set_backend(db)
+    logger.ensure_schema()
+    db.execute_script(importer.SCHEMA)
+    yield db
+    storage.set_backend(None)
+    db.close()
+
+
+def _message_count(db):
+    with db.cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS n FROM messages")
+        return cur.fetchone()["n"]
+
+
+def _write_jsonl(path, n):
+    with open(path, "w", encoding="utf-8") as fh:
+        for i in range(n):
+            fh.write(json.dumps({
+                "message_id": str(i + 1),
+                "author_id": "42",
+                "author_name": "ana",
+                "content": f"message {i}",
+                "created_at": 1700000000 + i,
+            }) + "\n")
+
+
+def test_resume_skips_committed_records(backend, tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    _write_jsonl(path, 5)
+    first = importer.import_file(backend, path, channel_id="7", batch_size=2)
+    assert first == {"records": 5, "inserted": 5, "skipped": 0}
+    assert backend.get_import_progress(importer.source_key(path, "7")) == 5
+    again = importer.import_file(backend, path, channel_id="7", batch_size=2)
+    assert again["inserted"] == 0
+    assert _message_count(backend) == 5
+
+
+def test_unusable_file_is_not_marked_done(backend, tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    _write_jsonl(path, 5)
+    with pytest.raises(ValueError, match="--channel-id"):
+        importer.import_file(backend, path)
+    assert backend.get_import_progress(importer.source_key(path)) == 0
+    stats = importer.import_file(backend, path, channel_id="7")
+    assert stats["inserted"] == 5
+
+
+def test_unusable_run_fails_before_commit(backend, tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    _write_jsonl(path, 5)
+    with pytest.raises(ValueError):
+        importer.import_file(backend, path, batch_size=3)
+    assert _message_count(backend) == 0
+
+
+def test_overrides_change_the_resume_key(tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    _write_jsonl(path, 1)
+    assert importer.source_key(path) != importer.source_key(path, "7")
+    assert importer.source_key(path, "7") != importer.source_key(path, "7", "8")
+
+
+def _export(channel_name="general", n=3, channel_id="100"):
+    channel = {"id": channel_id, "name": channel_name} if channel_id else {"name": channel_name}
+    return json.dumps({
+        "guild": {"id": "200", "name": "messages"},
+        "channel": channel,
+        "topic": 'say "messages": [ here',
+        "messages": [
+            {
+                "id": str(i + 1),
+                "timestamp": f"2024-01-01T00:00:0{i}+00:00",
+                "content": f"hi {i}",
+                "author": {"id": "42", "name": "ana", "isBot": False},
+                "reference": {"messageId": str(i)} if i else None,
+            }
+            for i in range(n)
+        ],
+        "messageCount": n,
+    }, indent=2)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 1 << 20])
+def test_iter_json_reads_header_and_messages(chunk_size):
+    header = {}
+    records = list(importer._iter_json(io.StringIO(_export("messages")), header, chunk_size=chunk_size))
+    assert [r["id"] for r in records] == ["1", "2", "3"]
+    assert header["channel"] == {"id": "100", "name": "messages"}
+    assert header["guild"]["id"] == "200"
+
+
+def test_iter_json_top_level_array():
+    header = {}
+    records = list(importer._iter_json(io.StringIO('[{"id": 1}, {"id": 2}]'), header, chunk_size=4))
+    assert records == [{"id": 1}, {"id": 2}]
+    assert header == {}
+
+
+def test_iter_json_without_messages_raises():
+    with pytest.raises(ValueError):
+        list(importer._iter_json(io.StringIO('{"channel": {"id": "1"}, "name": "messages"}'), {}))
+
+
+def test_normalize_exporter_message():
+    rec = json.loads(_export(n=2))["messages"][1]
+    row = importer.normalize(rec, "100", "200")
+    assert row[:8] == ("2", "100", "200", "42", "ana", "hi 1", False, "1")
+    assert row[8].isoformat() == "2024-01-01T00:00:01+00:00"
+
+
+def test_normalize_flat_record_without_id():
+    rec = {"author_id": "42", "author_name": "ana", "content": "x", "created_at": "1700000000000", "is_bot": "true"}
+    row = importer.normalize(rec, "7", None)
+    assert row[0].startswith("csv:") and row[0] == importer.normalize(dict(rec), "7", None)[0]
+    assert row[1:7] == ("7", None, "42", "ana", "x", True)
+    assert row[8].timestamp() == 1700000000
+
+
+def test_normalize_rejects_records_without_channel():
+    assert importer.normalize({"author_id": "42", "created_at": 1700000000}, None, None) is None
+
+
+def test_export_without_channel_id_fails(backend, tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(_export(channel_id=None), encoding="utf-8")
+    with pytest.raises(ValueError, match="--channel-id"):
+        importer.import_file(backend, str(path))
+    stats = importer.import_file(backend, str(path), channel_id="100")
+    assert stats == {"records": 3, "inserted": 3, "skipped": 0}
+
+
+def test_export_of_channel_named_messages(backend, tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(_export("messages"), encoding="utf-8")
+    stats = importer.import_file(backend, str(path))
+    assert stats == {"records": 3, "inserted": 3, "skipped": 0}
@@ -0,0 +1,37 @@
+import pytest
+
+import memory
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def mem():
+    db = SQLiteBackend(":memory:")
+    yield memory.Memory(backend=db)
+    db.close()
+
+
+def _queued(mem):
+    with mem.backend.cursor() as cur:
+        cur.execute("SELECT user_id, text FROM fact_queue ORDER BY id")
+        return [(r["user_id"], r["text"]) for r in cur.fetchall()]
+
+
+def test_drain_requeues_batches_when_extraction_fails(mem, monkeypatch):
+    for user in ("1", "2", "3"):
+        mem.queue_fact_batch(user, None, f"text {user}")
+
+    def extract(text):
+        if text == "text 2":
+            raise RuntimeError("model unavailable")
+        return [{"type": "user", "fact": f"likes {text}"}]
+
+    monkeypatch.setattr(memory, "extract_facts", extract)
+    with pytest.raises(RuntimeError):
+        mem.drain_fact_queue(limit=5)
+    assert _queued(mem) == [("2", "text 2"), ("3", "text 3")]
+    assert mem.get_facts(1) == ["likes text 1"]
+
+    monkeypatch.setattr(memory, "extract_facts", lambda text: [])
+    assert mem.drain_fact_queue(limit=5) == 2
+    assert _queued(mem) == []
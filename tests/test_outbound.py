@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+import outbound
+
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, content, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(content)
+
+
+def _http_error(status):
+    return discord.HTTPException(SimpleNamespace(status=status, reason="error", headers={}), "error")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(_):
+        pass
+
+    monkeypatch.setattr(outbound.asyncio, "sleep", sleep)
+
+
+def _send(channel):
+    box = outbound.Outbox()
+    return asyncio.run(box._send(channel, outbound.TokenBucket(5, 5.0), "hello"))
+
+
+def test_send_retries_rate_limits():
+    channel = FakeChannel(_http_error(429), discord.RateLimited(0.0))
+    assert _send(channel)
+    assert channel.sent == ["hello"]
+
+
+@pytest.mark.parametrize("error", [_http_error(500), _http_error(503), asyncio.TimeoutError(), ConnectionResetError()])
+def test_send_does_not_retry_what_may_have_been_delivered(error):
+    channel = FakeChannel(error)
+    assert not _send(channel)
+    assert channel.sent == []
+
+
+def _fences(chunk):
+    return sum(1 for line in chunk.splitlines() if line.lstrip().startswith(("```", "~~~")))
+
+
+def test_chunk_short_message_is_one_chunk():
+    text = "hello\n\n```\ncode\n```\n\nbye"
+    assert outbound.chunk_message(text) == [text]
+    assert outbound.chunk_message("") == []
+
+
+def test_chunk_respects_discord_limit():
+    text = "\n\n".join("word " * 150 for _ in range(20))
+    chunks = outbound.chunk_message(text)
+    assert len(chunks) > 1
+    assert all(len(c) <= outbound.DISCORD_MESSAGE_LIMIT for c in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_chunk_oversized_prose_breaks_at_whitespace():
+    text = " ".join(f"w{i}" for i in range(1000))
+    chunks = outbound.chunk_message(text, limit=100)
+    assert all(len(c) <= 100 for c in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_chunk_oversized_word_is_hard_cut():
+    chunks = outbound.chunk_message("x" * 250, limit=100)
+    assert chunks == ["x" * 100, "x" * 100, "x" * 50]
+
+
+def test_chunk_keeps_code_block_whole_when_it_fits():
+    code = "```py\n" + "print(1)\n" * 8 + "```"
+    chunks = outbound.chunk_message("intro " * 12 + "\n\n" + code, limit=100)
+    assert chunks[-1] == code
+
+
+def test_chunk_refences_oversized_code_block():
+    code = "```python\n" + "".join(f"line {i}\n" for i in range(60)) + "```"
+    chunks = outbound.chunk_message("before\n\n" + code + "\n\nafter", limit=100)
+    assert chunks[0] == "before"
+    assert chunks[-1].endswith("```\n\nafter")  # the tail piece shares a chunk with what follows
+    code_chunks = chunks[1:]
+    assert len(code_chunks) > 1
+    for chunk in code_chunks:
+        assert len(chunk) <= 100
+        assert chunk.startswith("```python\n") and _fences(chunk) == 2
+    lines = [l for c in code_chunks for l in c.splitlines() if l.startswith("line")]
+    assert lines == [f"line {i}" for i in range(60)]
+
+
+def test_chunk_unclosed_fence():
+    text = "see:\n\n~~~\n" + "".join(f"row {i}\n" for i in range(40))
+    chunks = outbound.chunk_message(text, limit=80)
+    assert chunks[0] == "see:"
+    assert all(len(c) <= 80 and c.startswith("~~~\n") for c in chunks[1:])
+    assert all(_fences(c) == 2 for c in chunks[1:-1])
+    assert _fences(chunks[-1]) == 1
+    rows = [l for c in chunks[1:] for l in c.splitlines() if l != "~~~"]
+    assert rows == [f"row {i}" for i in range(40)]
+
+
+def test_chunk_long_lines_inside_code_are_cut():
+    code = "```\n" + "y" * 300 + "\n```"
+    chunks = outbound.chunk_message(code, limit=100)
+    assert all(len(c) <= 100 and _fences(c) == 2 for c in chunks)
+    assert "".join(c.replace("```", "").replace("\n", "") for c in chunks) == "y" * 300
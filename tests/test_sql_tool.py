@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+import sql_tool
+from sql_tool import QueryRejected, run_query, run_tool_call, validate_query
+from storage import SQLiteBackend
+
+
+@pytest.fixture
+def backend():
+    db = SQLiteBackend(":memory:")
+    db.execute_script([
+        "CREATE TABLE messages (message_id INTEGER PRIMARY KEY, author_name TEXT, content TEXT)",
+        "CREATE TABLE secrets (k TEXT)",
+        "INSERT INTO messages (message_id, author_name, content) VALUES (1, 'ana', 'hello'), (2, 'bo', 'hi there')",
+        "INSERT INTO secrets (k) VALUES ('hunter2')",
+    ])
+    sql_tool._cache = sql_tool._TTLCache(sql_tool.SQL_TOOL_CACHE_TTL, sql_tool.SQL_TOOL_CACHE_SIZE)
+    return db
+
+
+@pytest.mark.parametrize("sql", [
+    "select * from secrets",
+    "select * from (secrets)",
+    "select * from messages join (secrets) on 1=1",
+    "select (select k from (secrets))",
+    "with t as (table secrets) select * from t",
+    "select query_to_xml('select * from secrets', true, true, '')",
+    "select content from messages where content like '%hi%'",
+    "select * from messages; select * from secrets",
+    "delete from messages",
+])
+def test_validate_query_rejects(sql):
+    with pytest.raises(QueryRejected):
+        validate_query(sql, [])
+
+
+@pytest.mark.parametrize("sql", [
+    "select extract(epoch from created_at) from messages",
+    "select substring(content from 1 for 10), trim(both from author_name) from messages",
+    "select * from messages where message_id in (select reference_id from turns)",
+])
+def test_validate_query_accepts_from_inside_function_calls(sql):
+    assert validate_query(sql, []) == sql
+
+
+@pytest.mark.parametrize("sql", [
+    "select extract(epoch from created_at) from secrets",
+    "select coalesce((select k from secrets), '') from messages",
+    "select * from messages where exists (select 1 from (secrets))",
+])
+def test_validate_query_still_checks_subqueries(sql):
+    with pytest.raises(QueryRejected, match="secrets"):
+        validate_query(sql, [])
+
+
+def test_validate_query_accepts_parameters():
+    assert validate_query("SELECT content FROM messages WHERE content LIKE %s", ["%hi%"]) == (
+        "select content from messages where content like %s"
+    )
+
+
+@pytest.mark.parametrize("sql", [
+    "select * from (secrets)",
+    "select (select k from (secrets))",
+    "with t as (select k from secrets) select * from t",
+    "select count(*) from secrets",
+    "select name from sqlite_master",
+])
+def test_engine_denies_tables_outside_the_allow_list(backend, sql):
+    with pytest.raises(sqlite3.DatabaseError):
+        backend.run_readonly(sql, [], 2000, 50, sql_tool.SQL_TOOL_ALLOWED_TABLES)
+
+
+def test_engine_denies_writes(backend):
+    with pytest.raises(sqlite3.DatabaseError):
+        backend.run_readonly("delete from messages", [], 2000, 50, sql_tool.SQL_TOOL_ALLOWED_TABLES)
+
+
+def test_run_query_returns_rows_and_caches(backend):
+    sql = "select author_name from messages where content like %s order by message_id"
+    first = run_query(sql, ["h%"], backend=backend)
+    assert first["columns"] == ["author_name"]
+    assert first["rows"] == [["ana"], ["bo"]]
+    assert not first["truncated"] and not first["cached"]
+    assert run_query(sql, ["h%"], backend=backend)["cached"]
+
+
+def test_run_query_truncates(backend, monkeypatch):
+    monkeypatch.setattr(sql_tool, "SQL_TOOL_MAX_ROWS", 1)
+    result = run_query("select message_id from messages order by message_id", [], backend=backend)
+    assert result["rows"] == [[1]]
+    assert result["truncated"]
+
+
+def test_run_tool_call_reports_rejections(backend):
+    assert "query rejected" in run_tool_call('{"sql": "select * from (secrets)", "params": []}', backend=backend)